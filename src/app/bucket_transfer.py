@@ -0,0 +1,55 @@
+import boto3
+from io import BytesIO
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+
+MB = 1024 * 1024
+
+
+class BucketTransfer:
+    def __init__(
+        self, 
+        bucket_name: str, 
+        endpoint_url: str, 
+        aws_access_key_id: str, 
+        aws_secret_access_key: str, 
+        max_pool_connections: int = 16, 
+        max_attempts: int = 5, 
+        multipart_threshold: int = 8 * MB, 
+        multipart_chunksize: int = 8 * MB, 
+        multipart_concurrency: int = 4
+    ):
+        self.bucket_name = bucket_name
+        self.max_pool_connections = max(1, max_pool_connections)
+
+        # Adaptive mode retries throttling with backoff and rate limits the client
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            config=Config(
+                max_pool_connections=self.max_pool_connections,
+                retries={'total_max_attempts': max_attempts, 'mode': 'adaptive'}
+            )
+        )
+
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max(1, multipart_concurrency)
+        )
+
+
+    def download(self, key: str) -> bytes:
+        buffer = BytesIO()
+        self.client.download_fileobj(self.bucket_name, key, buffer, Config=self.transfer_config)
+        return buffer.getvalue()
+
+
+    def upload(self, key: str, data: bytes):
+        self.client.upload_fileobj(BytesIO(data), self.bucket_name, key, Config=self.transfer_config)
+
+
+    def upload_file(self, key: str, file_path: str):
+        self.client.upload_file(file_path, self.bucket_name, key, Config=self.transfer_config)
\ No newline at end of file
@@ -0,0 +1,77 @@
+import shutil
+from pathlib import Path
+from typing import Optional
+from runpod import RunPodLogger
+
+log = RunPodLogger()
+
+
+class CleanupPolicy:
+    ALWAYS = "always"
+    NEVER = "never"
+    PRESSURE = "pressure"
+    EVERY_N = "every_n"
+
+    def __init__(
+        self, 
+        mode: str = ALWAYS, 
+        every_n: int = 10, 
+        path: Optional[Path] = None, 
+        min_free_disk: int = 0, 
+        min_free_memory: int = 0
+    ):
+        if mode not in {self.ALWAYS, self.NEVER, self.PRESSURE, self.EVERY_N}:
+            raise ValueError(f"Unknown cleanup policy: '{mode}'")
+        self.mode = mode
+        self.every_n = max(1, every_n)
+        self.path = path
+        self.min_free_disk = min_free_disk
+        self.min_free_memory = min_free_memory
+        self.jobs_since_clear = 0
+
+
+    def job_done(self):
+        self.jobs_since_clear += 1
+
+
+    def should_clear(self, active_jobs: int = 0) -> bool:
+        # Clearing drains every running job, so "always" waits for an idle moment in shared mode
+        if self.mode == self.ALWAYS:
+            return active_jobs == 0
+        if self.mode == self.EVERY_N:
+            return self.jobs_since_clear >= self.every_n
+        if self.mode == self.PRESSURE:
+            return self.jobs_since_clear > 0 and self._is_under_pressure()
+        return False
+
+
+    def cleared(self):
+        self.jobs_since_clear = 0
+
+
+    def _is_under_pressure(self) -> bool:
+        if self.min_free_disk and self.path:
+            free_disk = shutil.disk_usage(self.path).free
+            if free_disk < self.min_free_disk:
+                log.info(f"Disk pressure: {free_disk} bytes free")
+                return True
+
+        if self.min_free_memory:
+            free_memory = self._get_available_memory()
+            if free_memory is not None and free_memory < self.min_free_memory:
+                log.info(f"Memory pressure: {free_memory} bytes available")
+                return True
+
+        return False
+
+
+    @staticmethod
+    def _get_available_memory() -> Optional[int]:
+        try:
+            with open("/proc/meminfo", "r") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
\ No newline at end of file
@@ -0,0 +1,164 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+from pathlib import Path
+from typing import Optional, List
+from pydantic import BaseModel
+from runpod import RunPodLogger
+
+log = RunPodLogger()
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class DbSnapshot(BaseModel):
+    path: Path
+    fingerprint: str
+    state: List[List[int]]
+
+
+class DbSync:
+    def __init__(self, local_db: Path, storage_db: Path, local_models_path: Optional[Path] = None):
+        self.local_db = local_db
+        self.storage_db = storage_db
+        self.local_models_path = local_models_path
+        self.storage_fingerprint_path = storage_db.with_name(storage_db.name + ".sha256")
+        self.local_sync_path = local_db.with_name(local_db.name + ".sync.json")
+
+        # What the local DB looked like at the last sync (survives prep.py -> handler.py)
+        self.synced = self._read_local_sync()
+
+
+    def is_local_changed(self) -> bool:
+        return self.synced.get("state") != self._local_state()
+
+
+    def snapshot(self) -> DbSnapshot:
+        # Online backup gives a consistent copy while InvokeAI keeps the DB open
+        state = self._local_state()
+        snapshot_path = self.local_db.with_name(self.local_db.name + ".snapshot")
+        if snapshot_path.exists():
+            snapshot_path.unlink()
+
+        source = sqlite3.connect(self.local_db, timeout=30)
+        try:
+            target = sqlite3.connect(snapshot_path)
+            try:
+                source.backup(target)
+                self._strip_local_model_paths(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+
+        return DbSnapshot(path=snapshot_path, fingerprint=self._hash_file(snapshot_path), state=state)
+
+
+    def push(self, snapshot: DbSnapshot) -> bool:
+        # Caller holds the storage lock
+        try:
+            if self.storage_db.is_file() and self._read_storage_fingerprint() == snapshot.fingerprint:
+                log.info("Sync: storage DB already up to date")
+                self._write_local_sync(snapshot.fingerprint, snapshot.state)
+                return False
+
+            temp_path = self.storage_db.with_name(self.storage_db.name + ".tmp")
+            shutil.copyfile(snapshot.path, temp_path)
+            os.replace(temp_path, self.storage_db)
+            self._write_text(self.storage_fingerprint_path, snapshot.fingerprint)
+            self._write_local_sync(snapshot.fingerprint, snapshot.state)
+            log.info(f"Sync: storage ({self.storage_db}) <- invoke ({self.local_db})")
+            return True
+        finally:
+            snapshot.path.unlink(missing_ok=True)
+
+
+    def pull(self) -> bool:
+        # Caller holds the storage lock; InvokeAI must not be running yet
+        if not self.storage_db.is_file():
+            return False
+
+        fingerprint = self._read_storage_fingerprint()
+        if fingerprint and self.synced.get("fingerprint") == fingerprint and not self.is_local_changed():
+            log.info("Sync: invoke DB already up to date")
+            return False
+
+        temp_path = self.local_db.with_name(self.local_db.name + ".tmp")
+        shutil.copyfile(self.storage_db, temp_path)
+        if not fingerprint:
+            fingerprint = self._hash_file(temp_path)
+
+        # A leftover WAL from an older DB would be replayed into the new one
+        for suffix in ("-wal", "-shm", "-journal"):
+            Path(f"{self.local_db}{suffix}").unlink(missing_ok=True)
+        os.replace(temp_path, self.local_db)
+
+        self._write_local_sync(fingerprint, self._local_state())
+        log.info(f"Sync: storage ({self.storage_db}) -> invoke ({self.local_db})")
+        return True
+
+
+    def _strip_local_model_paths(self, connection: sqlite3.Connection):
+        # Models served from this worker's local cache go to storage with their models_dir path
+        if not self.local_models_path:
+            return
+        prefix = self.local_models_path.as_posix().rstrip("/") + "/"
+        try:
+            connection.execute(
+                "UPDATE models SET config = json_set(config, '$.path', substr(json_extract(config, '$.path'), ?)) "
+                "WHERE substr(json_extract(config, '$.path'), 1, ?) = ?",
+                (len(prefix) + 1, len(prefix), prefix)
+            )
+            connection.commit()
+        except sqlite3.OperationalError as e:
+            log.warn(f"Sync: failed to rewrite local model paths: {e}")
+
+
+    def _local_state(self) -> List[List[int]]:
+        # In WAL mode commits land in -wal, so both files are part of the state
+        state = []
+        for path in (self.local_db, Path(f"{self.local_db}-wal")):
+            try:
+                stat = path.stat()
+                state.append([stat.st_size, stat.st_mtime_ns])
+            except FileNotFoundError:
+                state.append([])
+        return state
+
+
+    def _read_storage_fingerprint(self) -> Optional[str]:
+        try:
+            return self.storage_fingerprint_path.read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+
+    def _read_local_sync(self) -> dict:
+        try:
+            with open(self.local_sync_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+
+    def _write_local_sync(self, fingerprint: str, state: List[List[int]]):
+        self.synced = {"fingerprint": fingerprint, "state": state}
+        self._write_text(self.local_sync_path, json.dumps(self.synced))
+
+
+    @staticmethod
+    def _write_text(path: Path, text: str):
+        temp_path = path.with_name(path.name + ".tmp")
+        temp_path.write_text(text)
+        os.replace(temp_path, path)
+
+
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
\ No newline at end of file
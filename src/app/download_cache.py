@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import shutil
+from pathlib import Path
+from typing import Optional, Dict, List, Any
+from runpod import RunPodLogger
+from .model_hasher import ModelHasher
+from .stale_portaLock import StalePortaLock
+
+log = RunPodLogger()
+
+# InvokeAI writes a download to "<name>.downloading" and renames it when complete
+PARTIAL_SUFFIX = ".downloading"
+
+STATS_KEYS = ("hits", "misses", "hit_bytes", "deduplicated_bytes", "evicted", "evicted_bytes")
+
+
+class DownloadCache:
+    def __init__(
+        self,
+        cache_path: Path,
+        hasher: ModelHasher,
+        lock: StalePortaLock,
+        max_bytes: int = 0,
+        interval: float = 60,
+        settle_time: float = 60
+    ):
+        # InvokeAI keeps one folder per source URL (slugified) in download_cache_dir
+        self.cache_path = cache_path
+        self.hasher = hasher
+        self.lock = lock
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.settle_time = settle_time
+        self.index_path = cache_path / ".index.json"
+        self.blobs_path = cache_path / ".blobs"
+        self.last_refresh = 0.0
+        self._stats: Dict[str, int] = {}
+
+
+    def is_enabled(self) -> bool:
+        return self.max_bytes > 0
+
+
+    def is_due(self) -> bool:
+        return self.is_enabled() and time.time() - self.last_refresh >= self.interval
+
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+
+    def refresh(self):
+        # Index, deduplicate and trim the cache; the index is shared by every worker on the volume
+        self.last_refresh = time.time()
+        if not self.cache_path.is_dir():
+            return
+        with self.lock:
+            index = self._load_index()
+            entries: Dict[str, Dict[str, Any]] = index["entries"]
+            stats: Dict[str, int] = index["stats"]
+
+            found = set()
+            for path in self.cache_path.iterdir():
+                if path.name.startswith("."):
+                    continue
+                files = self._get_files(path)
+                if files is None:
+                    continue
+                found.add(path.name)
+                entry = entries.get(path.name)
+                last_access = self._get_last_access(files)
+                if not entry:
+                    # Someone downloaded it since the last refresh
+                    stats["misses"] += 1
+                    entry = entries[path.name] = {"last_used": last_access, "files": {}}
+                elif last_access > entry["accessed"] + 1:
+                    stats["hits"] += 1
+                    stats["hit_bytes"] += entry["size"]
+                    entry["last_used"] = last_access
+                stats["deduplicated_bytes"] += self._index_files(path, files, entry)
+
+                # Hashing reads the files too, so hits are counted from the access time after it
+                entry["accessed"] = self._get_last_access(files)
+                entry["size"] = sum(size for size, _, _, _ in entry["files"].values())
+
+            for name in set(entries) - found:
+                del entries[name]
+
+            evicted = self._evict(entries)
+            stats["evicted"] += len(evicted)
+            stats["evicted_bytes"] += sum(size for size in evicted.values())
+            self._remove_orphan_blobs()
+            self._save_index(index)
+
+            self._stats = {
+                "items": len(entries),
+                "bytes": self._get_used_bytes(entries),
+                **stats
+            }
+        log.info(f"Download cache: {self._stats}")
+
+
+    def _get_files(self, path: Path) -> Optional[List[Path]]:
+        # None while a download is still being written
+        files = [path] if path.is_file() else sorted(file for file in path.rglob("*") if file.is_file())
+        if not files:
+            return None
+        now = time.time()
+        for file in files:
+            if file.name.endswith(PARTIAL_SUFFIX) or now - file.stat().st_mtime < self.settle_time:
+                return None
+        return files
+
+
+    def _index_files(self, path: Path, files: List[Path], entry: Dict[str, Any]) -> int:
+        # Hash new or changed files and hardlink identical ones to one blob per content hash
+        indexed = {}
+        changed = []
+        for file in files:
+            name = file.relative_to(path).as_posix() if file != path else file.name
+            stat = file.stat()
+            known = entry["files"].get(name)
+            if known and known[:3] == [stat.st_size, stat.st_mtime_ns, stat.st_ino]:
+                indexed[name] = known
+            else:
+                changed.append((name, file))
+
+        deduplicated = 0
+        if changed:
+            hashes = self.hasher.hash_models([(file, "blake3") for _, file in changed])
+            os.makedirs(self.blobs_path, exist_ok=True)
+            for (name, file), digest in zip(changed, hashes):
+                if self._link_blob(file, self.blobs_path / digest):
+                    deduplicated += file.stat().st_size
+                stat = file.stat()
+                indexed[name] = [stat.st_size, stat.st_mtime_ns, stat.st_ino, digest]
+
+        entry["files"] = indexed
+        return deduplicated
+
+
+    @staticmethod
+    def _link_blob(file: Path, blob: Path) -> bool:
+        # True when the file was replaced by a link to an identical blob
+        try:
+            if not blob.exists():
+                os.link(file, blob)
+                return False
+            if os.path.samefile(file, blob):
+                return False
+            temp_path = file.with_name(f"{file.name}.link-{os.getpid()}")
+            os.link(blob, temp_path)
+            os.replace(temp_path, file)
+            return True
+        except OSError as e:
+            log.warn(f"Download cache: failed to deduplicate {file}: {e}")
+            return False
+
+
+    def _evict(self, entries: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+        # Least recently used first until the unique bytes fit the quota
+        evicted = {}
+        for name in sorted(entries, key=lambda name: entries[name]["last_used"]):
+            if self._get_used_bytes(entries) <= self.max_bytes:
+                break
+            path = self.cache_path / name
+            log.info(f"Download cache: evict {name}")
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            evicted[name] = entries.pop(name)["size"]
+        return evicted
+
+
+    @staticmethod
+    def _get_used_bytes(entries: Dict[str, Dict[str, Any]]) -> int:
+        # Deduplicated files share an inode, so they are counted once
+        inodes = {}
+        for entry in entries.values():
+            for size, _, inode, _ in entry["files"].values():
+                inodes[inode] = size
+        return sum(inodes.values())
+
+
+    @staticmethod
+    def _get_last_access(files: List[Path]) -> float:
+        return max(max(stat.st_atime, stat.st_mtime) for stat in (file.stat() for file in files))
+
+
+    def _remove_orphan_blobs(self):
+        # A blob only linked from the blobs folder belongs to no entry anymore
+        if not self.blobs_path.is_dir():
+            return
+        for blob in self.blobs_path.iterdir():
+            if blob.is_file() and blob.stat().st_nlink == 1:
+                blob.unlink(missing_ok=True)
+
+
+    def _load_index(self) -> Dict[str, Any]:
+        index = {"entries": {}, "stats": {}}
+        try:
+            with open(self.index_path, "r") as f:
+                index.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.error(f"Failed to read download cache index {self.index_path}: {e}")
+        for key in STATS_KEYS:
+            index["stats"].setdefault(key, 0)
+        return index
+
+
+    def _save_index(self, index: Dict[str, Any]):
+        temp_path = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
\ No newline at end of file
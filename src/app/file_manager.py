@@ -1,48 +1,455 @@
 import os
+import io
+import json
+import queue
+import asyncio
+import hashlib
 import aiohttp
 import zipfile
 import tarfile
 import shutil
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, List, Dict, Any
 from runpod import RunPodLogger
 
 log = RunPodLogger()
 
+CHUNK_SIZE = 1024 * 1024
+STATE_SAVE_SIZE = 64 * CHUNK_SIZE
+STREAM_QUEUE_CHUNKS = 16
+MERGE_WORKERS = 8
+FICLONE = 0x40049409
+
+# Archives that can be unpacked straight from the download stream
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+TAR_ZSTD_SUFFIXES = (".tar.zst", ".tzst")
+
+
+class ChunkStream(io.RawIOBase):
+    # Blocking reader fed with chunks from the event loop, for tarfile running in a thread
+    def __init__(self, max_chunks: int = STREAM_QUEUE_CHUNKS):
+        self._queue: queue.Queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = memoryview(b"")
+        self._aborted = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not len(self._buffer):
+            if self._aborted:
+                raise IOError("Download aborted")
+            chunk = self._queue.get()
+            if chunk is None:
+                if self._aborted:
+                    raise IOError("Download aborted")
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    async def feed(self, chunk: Optional[bytes], consumer: asyncio.Future):
+        # Backpressure without blocking the loop; stop feeding once the consumer is gone
+        while not consumer.done():
+            try:
+                self._queue.put_nowait(chunk)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.01)
+
+    def abort(self):
+        self._aborted = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
 
 class FileManager:
     @staticmethod
-    async def download_file(url: str, dest: str) -> str:
+    def create_session() -> aiohttp.ClientSession:
+        # No total timeout: multi-GB downloads run far longer than aiohttp's default 5 minutes
+        return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60))
+
+    @staticmethod
+    async def download_file(
+        url: str, 
+        dest: str, 
+        expected_hash: Optional[str] = None, 
+        segments: int = 1, 
+        retries: int = 5, 
+        session: Optional[aiohttp.ClientSession] = None
+    ) -> str:
+        if not session:
+            async with FileManager.create_session() as session:
+                return await FileManager.download_file(url, dest, expected_hash, segments, retries, session)
+
         log.log(f"Starting download from '{url}'")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                filename = url.split("/")[-1]
-                file_path = os.path.join(dest, filename)
-                base, ext = os.path.splitext(file_path)
-                counter = 1
-                while os.path.exists(file_path):
-                    file_path = f"{base}_{counter}{ext}"
-                    counter += 1
-                with open(file_path, 'wb') as f:
-                    f.write(await response.read())
-                log.log(f"Downloaded file to '{file_path}'")
-                return file_path
+        filename = url.split("?")[0].split("/")[-1]
+        part_path = os.path.join(dest, filename + ".part")
+        state_path = part_path + ".json"
+
+        # Kept between attempts and runs, so a broken download resumes where it stopped
+        FileManager._check_part(part_path, url)
+        size, accept_ranges = await FileManager._probe(session, url)
+        if segments > 1 and size and accept_ranges:
+            await FileManager._download_segments(session, url, part_path, size, segments, retries)
+            file_hash = None
+        else:
+            file_hash = await FileManager._download_stream(session, url, part_path, size, expected_hash, retries)
+
+        if expected_hash:
+            algorithm, expected = FileManager._parse_hash(expected_hash)
+            if file_hash is None:
+                file_hash = await asyncio.to_thread(FileManager.hash_file, part_path, algorithm)
+            if file_hash != expected:
+                os.remove(part_path)
+                raise ValueError(f"Hash mismatch for '{url}': expected {expected}, got {file_hash}")
+            log.log(f"Verified {algorithm} hash of '{filename}'")
+
+        file_path = os.path.join(dest, filename)
+        base, ext = os.path.splitext(file_path)
+        counter = 1
+        while os.path.exists(file_path):
+            file_path = f"{base}_{counter}{ext}"
+            counter += 1
+        os.replace(part_path, file_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        log.log(f"Downloaded file to '{file_path}'")
+        return file_path
 
     @staticmethod
-    def extract_archive(file_path: str, dest: str) -> str:
-        log.log(f"Extracting archive {file_path}")
-        filename = os.path.basename(file_path)
+    def hash_file(file_path: str, algorithm: str = "sha256") -> str:
+        hasher = FileManager._new_hasher(algorithm)
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _check_part(part_path: str, url: str):
+        # The part name only comes from the URL basename: resume only a part of the same URL
+        state_path = part_path + ".json"
+        if not os.path.exists(part_path):
+            return
+        if FileManager._read_state(state_path).get("url") != url:
+            log.log(f"Discard '{part_path}' of another download")
+            os.remove(part_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+
+    @staticmethod
+    def _read_state(state_path: str) -> Dict[str, Any]:
+        try:
+            with open(state_path, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    async def _probe(session: aiohttp.ClientSession, url: str) -> Tuple[Optional[int], bool]:
+        try:
+            async with session.head(url, allow_redirects=True) as response:
+                if response.status >= 400:
+                    return None, False
+                size = response.headers.get("Content-Length")
+                accept_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+                return (int(size) if size else None), accept_ranges
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None, False
+
+    @staticmethod
+    async def _download_stream(
+        session: aiohttp.ClientSession, 
+        url: str, 
+        part_path: str, 
+        size: Optional[int], 
+        expected_hash: Optional[str], 
+        retries: int
+    ) -> Optional[str]:
+        algorithm = FileManager._parse_hash(expected_hash)[0] if expected_hash else None
+        hasher: Any = None
+        hashed = 0
+        attempt = 0
+        state_path = part_path + ".json"
+        if "done" in FileManager._read_state(state_path) and os.path.exists(part_path):
+            # Preallocated by a segmented download: its size says nothing about the bytes done
+            os.remove(part_path)
+        with open(state_path, 'w') as f:
+            json.dump({"url": url}, f)
+        while True:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if size is not None and offset > size:
+                os.remove(part_path)
+                offset = 0
+            try:
+                headers = {"Range": f"bytes={offset}-"} if offset else {}
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 416 and offset:
+                        # Nothing left to fetch when the part already has the whole file, else start over
+                        if (size if size is not None else FileManager._get_range_size(response)) != offset:
+                            log.warn(f"Cannot resume '{part_path}' at {offset} bytes, restart")
+                            os.remove(part_path)
+                            continue
+                        log.log(f"Download already complete: '{part_path}'")
+                    else:
+                        response.raise_for_status()
+                        if offset and response.status != 206:
+                            # Range ignored by the server, start over
+                            offset = 0
+
+                        # Hash incrementally, re-reading the resumed prefix only when needed
+                        if algorithm and (hasher is None or hashed != offset):
+                            hasher = FileManager._new_hasher(algorithm)
+                            hashed = await asyncio.to_thread(FileManager._hash_prefix, hasher, part_path, offset)
+
+                        with open(part_path, 'ab' if offset else 'wb') as f:
+                            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                                f.write(chunk)
+                                if hasher:
+                                    hasher.update(chunk)
+                                    hashed += len(chunk)
+
+                if algorithm and (hasher is None or hashed != os.path.getsize(part_path)):
+                    return await asyncio.to_thread(FileManager.hash_file, part_path, algorithm)
+                return hasher.hexdigest() if hasher else None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                attempt += 1
+                await FileManager._retry_wait(e, attempt, retries, url)
+
+    @staticmethod
+    async def _download_segments(
+        session: aiohttp.ClientSession, 
+        url: str, 
+        part_path: str, 
+        size: int, 
+        segments: int, 
+        retries: int
+    ):
+        segment_size = -(-size // segments)
+        ranges = [(start, min(size, start + segment_size) - 1) for start in range(0, size, segment_size)]
+
+        # Bytes done per segment, persisted next to the part file for resume
+        state_path = part_path + ".json"
+        state = FileManager._read_state(state_path) if os.path.exists(part_path) else None
+        if not state or state.get("url") != url or state.get("size") != size or len(state.get("done", [])) != len(ranges):
+            state = {"url": url, "size": size, "done": [0] * len(ranges)}
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+        else:
+            log.log(f"Resume segmented download: {sum(state['done'])}/{size} bytes")
+
+        def save_state():
+            with open(state_path, 'w') as f:
+                json.dump(state, f)
+
+        async def fetch(index: int):
+            start, end = ranges[index]
+            attempt = 0
+            while state["done"][index] < end - start + 1:
+                offset = start + state["done"][index]
+                try:
+                    async with session.get(url, headers={"Range": f"bytes={offset}-{end}"}) as response:
+                        response.raise_for_status()
+                        if response.status != 206:
+                            raise RuntimeError(f"Server ignored the range request for '{url}'")
+                        with open(part_path, 'r+b') as f:
+                            f.seek(offset)
+                            unsaved = 0
+                            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                                f.write(chunk)
+                                state["done"][index] += len(chunk)
+                                unsaved += len(chunk)
+                                if unsaved >= STATE_SAVE_SIZE:
+                                    f.flush()
+                                    save_state()
+                                    unsaved = 0
+                            f.flush()
+                        save_state()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    attempt += 1
+                    await FileManager._retry_wait(e, attempt, retries, url)
+
+        log.log(f"Downloading {size} bytes in {len(ranges)} segments")
+        await asyncio.gather(*[fetch(index) for index in range(len(ranges))])
+
+    @staticmethod
+    def _get_range_size(response: aiohttp.ClientResponse) -> Optional[int]:
+        # A 416 reply may carry the full size as "Content-Range: bytes */<size>"
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+
+    @staticmethod
+    async def _retry_wait(error: Exception, attempt: int, retries: int, url: str):
+        # Client errors other than timeouts/throttling will not get better with a retry
+        if isinstance(error, aiohttp.ClientResponseError) and error.status < 500 and error.status not in (408, 429):
+            raise error
+        if attempt > retries:
+            raise error
+        delay = min(2 ** attempt, 30)
+        log.warn(f"Download of '{url}' failed ({error}), retry {attempt}/{retries} in {delay}s")
+        await asyncio.sleep(delay)
+
+    @staticmethod
+    def _parse_hash(expected_hash: str) -> Tuple[str, str]:
+        # "sha256:<hex>", "blake3:<hex>" or a bare sha256 hex digest
+        if ":" in expected_hash:
+            algorithm, value = expected_hash.split(":", 1)
+            return algorithm.lower(), value.lower()
+        return "sha256", expected_hash.lower()
+
+    @staticmethod
+    def _new_hasher(algorithm: str) -> Any:
+        if algorithm == "blake3":
+            from blake3 import blake3
+            return blake3(max_threads=blake3.AUTO)
+        return hashlib.new(algorithm)
+
+    @staticmethod
+    def _hash_prefix(hasher: Any, file_path: str, length: int) -> int:
+        hashed = 0
+        if length <= 0:
+            return hashed
+        with open(file_path, 'rb') as f:
+            while hashed < length and (chunk := f.read(min(CHUNK_SIZE, length - hashed))):
+                hasher.update(chunk)
+                hashed += len(chunk)
+        return hashed
+
+    @staticmethod
+    def is_stream_archive(url: str) -> bool:
+        name = url.split("?")[0].lower()
+        return name.endswith(TAR_SUFFIXES) or name.endswith(TAR_ZSTD_SUFFIXES)
+
+    @staticmethod
+    async def download_and_extract(
+        url: str, 
+        dest: str, 
+        expected_hash: Optional[str] = None, 
+        retries: int = 5, 
+        session: Optional[aiohttp.ClientSession] = None
+    ) -> str:
+        if not session:
+            async with FileManager.create_session() as session:
+                return await FileManager.download_and_extract(url, dest, expected_hash, retries, session)
+
+        filename = url.split("?")[0].split("/")[-1]
+        zstd = filename.lower().endswith(TAR_ZSTD_SUFFIXES)
+        algorithm = FileManager._parse_hash(expected_hash)[0] if expected_hash else None
+        extract_path = FileManager._get_extract_path(filename, dest)
+        log.log(f"Streaming '{url}' into '{extract_path}'")
+
+        # The archive never touches the disk; a broken stream restarts the extraction from scratch
+        attempt = 0
+        while True:
+            os.makedirs(extract_path, exist_ok=True)
+            hasher = FileManager._new_hasher(algorithm) if algorithm else None
+            stream = ChunkStream()
+            extract = asyncio.ensure_future(asyncio.to_thread(FileManager._extract_tar_stream, stream, extract_path, zstd))
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        if hasher:
+                            hasher.update(chunk)
+                        await stream.feed(chunk, extract)
+                        if extract.done() and extract.exception():
+                            break
+                await stream.feed(None, extract)
+                await extract
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                await FileManager._abort_extract(stream, extract, extract_path)
+                attempt += 1
+                await FileManager._retry_wait(e, attempt, retries, url)
+            except BaseException:
+                await FileManager._abort_extract(stream, extract, extract_path)
+                raise
+
+        if hasher:
+            file_hash = hasher.hexdigest()
+            if file_hash != FileManager._parse_hash(expected_hash)[1]:
+                shutil.rmtree(extract_path, ignore_errors=True)
+                raise ValueError(f"Hash mismatch for '{url}': got {file_hash}")
+            log.log(f"Verified {algorithm} hash of '{filename}'")
+
+        log.log(f"Extracted tar stream to '{extract_path}'")
+        return extract_path
+
+    @staticmethod
+    def _extract_tar_stream(stream: ChunkStream, extract_path: str, zstd: bool):
+        fileobj: Any = io.BufferedReader(stream, CHUNK_SIZE)
+        if zstd:
+            import zstandard
+            fileobj = zstandard.ZstdDecompressor().stream_reader(fileobj)
+        with tarfile.open(fileobj=fileobj, mode="r|" if zstd else "r|*") as tar_ref:
+            tar_ref.extractall(extract_path)
+
+    @staticmethod
+    async def _abort_extract(stream: ChunkStream, extract: asyncio.Future, extract_path: str):
+        stream.abort()
+        try:
+            await extract
+        except Exception:
+            pass
+        shutil.rmtree(extract_path, ignore_errors=True)
+
+    @staticmethod
+    def _get_extract_path(filename: str, dest: str) -> str:
         extract_path = os.path.join(dest, filename + "_extracted")
         counter = 1
         while os.path.exists(extract_path):
             extract_path = os.path.join(dest, f"{filename}_extracted_{counter}")
             counter += 1
+        return extract_path
+
+    @staticmethod
+    def _extract_zip(file_path: str, extract_path: str, workers: Optional[int] = None):
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            members = zip_ref.infolist()
+
+        # ZipFile.extract checks then creates parent dirs, which races between threads; create them all first
+        for member in members:
+            member_path = FileManager._get_member_path(member, extract_path)
+            os.makedirs(member_path if member.is_dir() else os.path.dirname(member_path), exist_ok=True)
+        members = [member for member in members if not member.is_dir()]
+        if not members:
+            return
+        workers = max(1, min(workers or os.cpu_count() or 1, 8, len(members)))
+
+        # Spread members by size; each worker needs its own handle, ZipFile is not thread-safe
+        groups: List[List[zipfile.ZipInfo]] = [[] for _ in range(workers)]
+        for index, member in enumerate(sorted(members, key=lambda m: m.file_size, reverse=True)):
+            groups[index % workers].append(member)
+
+        def extract(group: List[zipfile.ZipInfo]):
+            with zipfile.ZipFile(file_path, 'r') as zip_ref:
+                for member in group:
+                    zip_ref.extract(member, extract_path)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(extract, groups))
+
+    @staticmethod
+    def _get_member_path(member: zipfile.ZipInfo, extract_path: str) -> str:
+        # Same sanitizing as ZipFile.extract: no absolute paths, drive letters or ".." parts
+        arcname = os.path.splitdrive(member.filename.replace('/', os.path.sep))[1]
+        parts = [part for part in arcname.split(os.path.sep) if part not in ('', os.path.curdir, os.path.pardir)]
+        return os.path.join(extract_path, *parts)
+
+    @staticmethod
+    def extract_archive(file_path: str, dest: str) -> str:
+        log.log(f"Extracting archive {file_path}")
+        extract_path = FileManager._get_extract_path(os.path.basename(file_path), dest)
         os.makedirs(extract_path, exist_ok=True)
 
         if zipfile.is_zipfile(file_path):
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_path)
-                log.log(f"Extracted zip file to '{extract_path}'")
+            FileManager._extract_zip(file_path, extract_path)
+            log.log(f"Extracted zip file to '{extract_path}'")
         elif tarfile.is_tarfile(file_path):
             with tarfile.open(file_path, 'r:*') as tar_ref:
                 tar_ref.extractall(extract_path)
@@ -56,29 +463,113 @@ class FileManager:
         return extract_path
     
     @staticmethod
-    def merge_directories(src: str, dest: str):
+    def merge_directories(
+        src: str, 
+        dest: str, 
+        link: bool = True, 
+        verify_hash: bool = False, 
+        workers: int = MERGE_WORKERS
+    ) -> Dict[str, int]:
         log.log(f"Merging directories from '{src}' to '{dest}'")
-        for root, dirs, files in os.walk(src):
+        files: List[Tuple[str, str]] = []
+        for root, dirs, names in os.walk(src):
             relative_path = os.path.relpath(root, src)
             dest_dir = os.path.join(dest, relative_path)
             os.makedirs(dest_dir, exist_ok=True)
-            for file in files:
-                src_file = os.path.join(root, file)
-                dest_file = os.path.join(dest_dir, file)
-                shutil.copy2(src_file, dest_file)
-                log.log(f"Copied {src_file} to {dest_file}")
+            for name in names:
+                files.append((os.path.join(root, name), os.path.join(dest_dir, name)))
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = list(executor.map(lambda f: FileManager._merge_file(f[0], f[1], link, verify_hash), files))
+
+        stats = {"copied_files": 0, "copied_bytes": 0, "linked_files": 0, "linked_bytes": 0, "skipped_files": 0, "skipped_bytes": 0}
+        for action, size in results:
+            stats[f"{action}_files"] += 1
+            stats[f"{action}_bytes"] += size
+        log.log(
+            f"Merged '{src}': copied {stats['copied_files']} files ({stats['copied_bytes']} bytes), "
+            f"linked {stats['linked_files']} ({stats['linked_bytes']} bytes), "
+            f"skipped {stats['skipped_files']} ({stats['skipped_bytes']} bytes)"
+        )
+        return stats
+
+    @staticmethod
+    def _merge_file(src_file: str, dest_file: str, link: bool, verify_hash: bool) -> Tuple[str, int]:
+        src_stat = os.stat(src_file)
+        if FileManager._is_same_file(src_file, dest_file, src_stat, verify_hash):
+            return "skipped", src_stat.st_size
+
+        # Write next to the target and swap in, so a crash never leaves a half-copied file
+        temp_file = f"{dest_file}.merge-{os.getpid()}"
+        try:
+            if link and src_stat.st_dev == os.stat(os.path.dirname(dest_file)).st_dev:
+                try:
+                    os.link(src_file, temp_file)
+                    os.replace(temp_file, dest_file)
+                    return "linked", src_stat.st_size
+                except OSError:
+                    pass
+                try:
+                    FileManager._reflink(src_file, temp_file)
+                    os.replace(temp_file, dest_file)
+                    return "linked", src_stat.st_size
+                except OSError:
+                    pass
+            shutil.copy2(src_file, temp_file)
+            os.replace(temp_file, dest_file)
+            return "copied", src_stat.st_size
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    @staticmethod
+    def _is_same_file(src_file: str, dest_file: str, src_stat: os.stat_result, verify_hash: bool) -> bool:
+        try:
+            dest_stat = os.stat(dest_file)
+        except FileNotFoundError:
+            return False
+        if (src_stat.st_dev, src_stat.st_ino) == (dest_stat.st_dev, dest_stat.st_ino):
+            return True
+        if src_stat.st_size != dest_stat.st_size:
+            return False
+        if verify_hash:
+            return FileManager.hash_file(src_file) == FileManager.hash_file(dest_file)
+        # copy2 keeps mtime, so an earlier merge of the same file matches here
+        return abs(src_stat.st_mtime - dest_stat.st_mtime) < 1
+
+    @staticmethod
+    def _reflink(src_file: str, dest_file: str):
+        # Copy-on-write clone (btrfs, XFS); raises OSError where unsupported
+        import fcntl
+        try:
+            with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            shutil.copystat(src_file, dest_file)
+        except OSError:
+            if os.path.exists(dest_file):
+                os.remove(dest_file)
+            raise
 
     @staticmethod
-    async def get_files(path: str, temp: str) -> Path:
+    async def get_files(
+        path: str, 
+        temp: str, 
+        expected_hash: Optional[str] = None, 
+        segments: int = 1, 
+        session: Optional[aiohttp.ClientSession] = None
+    ) -> Path:
         log.log(f"Getting files from '{path}' to '{temp}'")
         os.makedirs(temp, exist_ok=True)
 
         if path.startswith("http://") or path.startswith("https://"):
-            path = await FileManager.download_file(path, temp)
+            if FileManager.is_stream_archive(path):
+                path = await FileManager.download_and_extract(path, temp, expected_hash=expected_hash, session=session)
+            else:
+                path = await FileManager.download_file(path, temp, expected_hash=expected_hash, segments=segments, session=session)
 
         if os.path.isfile(path):
             if zipfile.is_zipfile(path) or tarfile.is_tarfile(path):
-                path = FileManager.extract_archive(path, temp)
+                path = await asyncio.to_thread(FileManager.extract_archive, path, temp)
 
         path = Path(path).resolve()
         log.log(f"Final path is {path}")
@@ -0,0 +1,116 @@
+import os
+import re
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Tuple
+from runpod import RunPodLogger
+from invoke import Invoke
+from invoke.api.models import ModelRecord
+from invoke.graph_builder.components import Graph
+from .model_registry import ModelRegistry, MODEL_FIELDS
+
+log = RunPodLogger()
+
+TEMPLATE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+class CachedTemplate:
+    def __init__(self, graph: Graph, mtime: float):
+        self.graph = graph
+        self.mtime = mtime
+        self.records: List[ModelRecord] = []
+        self.generation: Optional[int] = None
+
+
+class GraphTemplates:
+    def __init__(self, templates_path: Path, registry: ModelRegistry):
+        self.templates_path = templates_path
+        self.registry = registry
+        self.hits = 0
+        self.misses = 0
+        self._templates: Dict[str, CachedTemplate] = {}
+
+
+    def register(self, template_id: str, graph: str):
+        # Stored as a file, so every worker on the same storage can use it
+        path = self._get_path(template_id)
+        parsed = Graph.model_validate_json(graph)
+        os.makedirs(self.templates_path, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp_path.write_text(graph)
+        os.replace(temp_path, path)
+        self._templates[template_id] = CachedTemplate(parsed, path.stat().st_mtime)
+        log.info(f"Graph template registered: {template_id}")
+
+
+    async def get(self, invoke: Invoke, template_id: str, overrides: Optional[Dict[str, Any]] = None) -> Tuple[Graph, List[ModelRecord]]:
+        # Parsed and model-resolved once; a job only copies it and applies its overrides
+        template = self._load(template_id)
+        if template.generation != self.registry.generation:
+            template.records = await self.registry.resolve_graph(invoke, template.graph)
+            template.generation = self.registry.generation
+
+        graph = template.graph.model_copy(deep=True)
+        if not overrides:
+            return graph, list(template.records)
+
+        if self._apply_overrides(graph, overrides):
+            # A model was swapped: resolve the copy again
+            return graph, await self.registry.resolve_graph(invoke, graph)
+        return graph, list(template.records)
+
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "items": len(self._templates),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+    def _load(self, template_id: str) -> CachedTemplate:
+        path = self._get_path(template_id)
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            raise ValueError(f"Graph template '{template_id}' not found")
+
+        # Re-registered by another worker: the file changed under the cached copy
+        template = self._templates.get(template_id)
+        if template and template.mtime == mtime:
+            self.hits += 1
+            return template
+
+        self.misses += 1
+        template = self._templates[template_id] = CachedTemplate(Graph.model_validate_json(path.read_text()), mtime)
+        return template
+
+
+    @staticmethod
+    def _apply_overrides(graph: Graph, overrides: Dict[str, Any]) -> bool:
+        # "node_id.field" or "node_id.field.subfield" -> value; True when a model reference changed
+        models_changed = False
+        for address, value in overrides.items():
+            node_id, _, field_path = address.partition(".")
+            node = graph.nodes.get(node_id)
+            if node is None:
+                raise ValueError(f"Override '{address}': node '{node_id}' not found")
+            if not field_path:
+                raise ValueError(f"Override '{address}': field is missing")
+
+            fields = field_path.split(".")
+            target = node
+            for field in fields[:-1]:
+                if not isinstance(target.get(field), dict):
+                    raise ValueError(f"Override '{address}': field '{field}' not found")
+                target = target[field]
+            target[fields[-1]] = value
+
+            if MODEL_FIELDS.get(node["type"]) == fields[0]:
+                models_changed = True
+        return models_changed
+
+
+    def _get_path(self, template_id: str) -> Path:
+        if not TEMPLATE_ID_PATTERN.match(template_id):
+            raise ValueError(f"Invalid graph template id '{template_id}'")
+        return self.templates_path / f"{template_id}.json"
\ No newline at end of file
@@ -1,75 +1,67 @@
+import asyncio
 import base64
 import uuid
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List
-import boto3
-from botocore.exceptions import BotoCoreError, NoCredentialsError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Optional, Callable, Any
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
 from PIL import Image
 from io import BytesIO
 from .schema import ImageInfo, ImageData
+from .bucket_transfer import BucketTransfer
 
 
 class ImageProcessor:
-    def __init__(self, bucket_name=None, endpoint_url=None, aws_access_key_id=None, aws_secret_access_key=None):
-        self.bucket_client = None
-        self.bucket_name = None
+    def __init__(self, bucket_name=None, endpoint_url=None, aws_access_key_id=None, aws_secret_access_key=None, **transfer_options):
+        self.bucket: Optional[BucketTransfer] = None
 
         if bucket_name and endpoint_url and aws_access_key_id and aws_secret_access_key:
-            self.bucket_name = bucket_name
-            self.bucket_client = boto3.client(
-                's3',
+            self.bucket = BucketTransfer(
+                bucket_name=bucket_name,
                 endpoint_url=endpoint_url,
                 aws_access_key_id=aws_access_key_id,
                 aws_secret_access_key=aws_secret_access_key,
+                **transfer_options
             )
 
+        # One long-lived pool, sized to the S3 connection pool
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.bucket.max_pool_connections if self.bucket else None,
+            thread_name_prefix="image_processor"
+        )
 
-    def download_images(self, images: List[ImageInfo]) -> List[ImageData]:
-        results = []
 
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for image in images:
-                if image.cdn_id and image.base64:
-                    raise ValueError(f"Both 'cdn_id' and 'base64' provided for id {image.id}.")
-                elif image.cdn_id:
-                    if not self.bucket_client:
-                        raise ValueError("Bucket configuration is missing but 'cdn_id' is provided.")
-                    futures.append(executor.submit(self._download_from_cdn, image))
-                elif image.base64:
-                    futures.append(executor.submit(self._decode_base64, image))
-                else:
-                    raise ValueError(f"No valid data source ('cdn_id' or 'base64') for id {image.id}.")
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
 
-            for future in as_completed(futures):
-                results.append(future.result())
 
-        return results
+    def download_image(self, image: ImageInfo) -> ImageData:
+        self._validate_source(image)
+        if image.cdn_id:
+            return self._download_from_cdn(image)
+        return self._decode_base64(image)
 
 
-    def upload_images(self, images: List[ImageData]) -> List[ImageInfo]:
-        results = []
+    def upload_image(self, image: ImageData) -> ImageInfo:
+        if self.bucket:
+            return self._upload_to_cdn(image)
+        return self._encode_base64(image)
 
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for image in images:
-                if self.bucket_client:
-                    futures.append(executor.submit(self._upload_to_cdn, image))
-                else:
-                    futures.append(executor.submit(self._encode_base64, image))
 
-            for future in as_completed(futures):
-                results.append(future.result())
-
-        return results
+    def _validate_source(self, image: ImageInfo):
+        if image.cdn_id and image.base64:
+            raise ValueError(f"Both 'cdn_id' and 'base64' provided for id {image.id}.")
+        elif image.cdn_id:
+            if not self.bucket:
+                raise ValueError("Bucket configuration is missing but 'cdn_id' is provided.")
+        elif not image.base64:
+            raise ValueError(f"No valid data source ('cdn_id' or 'base64') for id {image.id}.")
 
 
     def _download_from_cdn(self, image: ImageInfo) -> ImageData:
         try:
-            response = self.bucket_client.get_object(Bucket=self.bucket_name, Key=image.cdn_id)
-            data = response['Body'].read()
+            data = self.bucket.download(image.cdn_id)
             return ImageData(data=data, id=image.id)
-        except (BotoCoreError, NoCredentialsError) as e:
+        except (BotoCoreError, ClientError, NoCredentialsError) as e:
             raise RuntimeError(f"Failed to download image with cdn_id {image.cdn_id}: {e}")
 
 
@@ -83,12 +75,18 @@ class ImageProcessor:
 
     def _upload_to_cdn(self, image: ImageData) -> ImageInfo:
         try:
+            if image.file_path:
+                # Streamed from disk, large files go multipart
+                key = self._generate_image_key(image.file_path)
+                self.bucket.upload_file(key, image.file_path)
+                return ImageInfo(cdn_id=key, id=image.id)
+
             data = self._get_image_data(image)
-            key = self._generate_image_key(image.data)
-            self.bucket_client.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+            key = self._generate_image_key(data)
+            self.bucket.upload(key, data)
 
             return ImageInfo(cdn_id=key, id=image.id)
-        except (BotoCoreError, NoCredentialsError) as e:
+        except (BotoCoreError, ClientError, NoCredentialsError) as e:
             raise RuntimeError(f"Failed to upload image for id {image.id}: {e}")
 
 
@@ -111,10 +109,10 @@ class ImageProcessor:
             raise RuntimeError(f"Failed to fetch data from URL {url}: {e}")
 
 
-    def _generate_image_key(self, data: bytes) -> str:
+    def _generate_image_key(self, data: Union[bytes, str]) -> str:
         try:
-            image = Image.open(BytesIO(data))
-            image_format = image.format.lower()  # Determine image format (e.g., jpg, png)
+            with Image.open(BytesIO(data) if isinstance(data, bytes) else data) as image:
+                image_format = image.format.lower()  # Determine image format (e.g., jpg, png)
             return f"{uuid.uuid4()}.{image_format}"
         except Exception as e:
             raise RuntimeError(f"Failed to generate image key from data: {e}")
@@ -123,7 +121,10 @@ class ImageProcessor:
     def _get_image_data(self, image: ImageData) -> bytes:
         if image.data:
             return image.data
+        elif image.file_path:
+            with open(image.file_path, 'rb') as f:
+                return f.read()
         elif image.download_url:
             return self._fetch_data_from_url(image.download_url)
         else:
-            raise ValueError(f"No data or download_url provided for id {image.id}.")
+            raise ValueError(f"No data, file_path or download_url provided for id {image.id}.")
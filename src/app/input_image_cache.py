@@ -0,0 +1,107 @@
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+from pydantic import BaseModel
+from .schema import ImageInfo
+
+
+class CachedImage(BaseModel):
+    image_name: str
+    size: int
+    pins: int = 0
+
+
+class InputImageCache:
+    def __init__(self, max_items: int = 256, max_bytes: int = 1024 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CachedImage]" = OrderedDict()
+
+
+    def is_enabled(self) -> bool:
+        return self.max_items > 0 and self.max_bytes > 0
+
+
+    @staticmethod
+    def source_key(image: ImageInfo) -> Optional[str]:
+        # cdn ids are treated as immutable, so they are a key before any download
+        return f"cdn:{image.cdn_id}" if image.cdn_id else None
+
+
+    @staticmethod
+    def content_key(data: bytes) -> str:
+        return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+    def names(self) -> Set[str]:
+        return {entry.image_name for entry in self._entries.values()}
+
+
+    def acquire(self, key: str) -> Optional[str]:
+        # Pinned entries are never evicted while a job uses them
+        entry = self._entries.get(key)
+        if not entry:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry.pins += 1
+        self._entries.move_to_end(key)
+        return entry.image_name
+
+
+    def add(self, key: str, image_name: str, size: int) -> str:
+        # Returns the cached name, which differs from image_name if another job won the race
+        entry = self._entries.get(key)
+        if entry:
+            entry.pins += 1
+            self._entries.move_to_end(key)
+            return entry.image_name
+        self._entries[key] = CachedImage(image_name=image_name, size=size, pins=1)
+        self.total_bytes += size
+        return image_name
+
+
+    def release(self, keys: List[str]):
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry and entry.pins > 0:
+                entry.pins -= 1
+
+
+    def discard(self, keys: List[str]) -> List[str]:
+        # Drop entries that may be stale, returns image names that can be deleted
+        removed: List[str] = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry and entry.pins == 0:
+                removed.append(self._remove(key))
+        return removed
+
+
+    def evict(self) -> List[str]:
+        # Least recently used first, returns image names that can be deleted
+        removed: List[str] = []
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_items and self.total_bytes <= self.max_bytes:
+                break
+            if self._entries[key].pins == 0:
+                removed.append(self._remove(key))
+        return removed
+
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "items": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+    def _remove(self, key: str) -> str:
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.size
+        return entry.image_name
\ No newline at end of file
@@ -1,20 +1,33 @@
 import os
+import re
 import argparse
 import asyncio
+import aiohttp
 import shutil
 import git
 import subprocess
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 from invoke import Invoke
 from config_install import ConfigInstall
 from file_manager import FileManager
 
+# pip-style hash in the URL fragment: https://host/model.safetensors#sha256=<hex>
+HASH_FRAGMENT = re.compile(r"^(.+)#(sha256|sha512|sha1|md5|blake3)=([0-9a-fA-F]+)$")
 
-async def copy_files(path: str, invoke_path: Path, temp: Path):
-    path = await FileManager.get_files(path, temp)
+
+def parse_entry(path: str) -> Tuple[str, Optional[str]]:
+    match = HASH_FRAGMENT.match(path)
+    if not match:
+        return path, None
+    return match.group(1), f"{match.group(2)}:{match.group(3)}"
+
+
+async def copy_files(path: str, invoke_path: Path, temp: Path, session: aiohttp.ClientSession, segments: int = 1):
+    path, expected_hash = parse_entry(path)
+    path = await FileManager.get_files(path, temp, expected_hash=expected_hash, segments=segments, session=session)
     if os.path.isdir(path):
-        FileManager.merge_directories(path, invoke_path)
+        await asyncio.to_thread(FileManager.merge_directories, path, invoke_path)
         return
     
     if os.path.isfile(path):
@@ -24,8 +37,9 @@ async def copy_files(path: str, invoke_path: Path, temp: Path):
     raise Exception("copy_files WTF")
 
 
-async def install_model(invoke: Invoke, path: str, temp: Path):
-    path = await FileManager.get_files(path, temp)
+async def install_model(invoke: Invoke, path: str, temp: Path, session: aiohttp.ClientSession, segments: int = 1):
+    path, expected_hash = parse_entry(path)
+    path = await FileManager.get_files(path, temp, expected_hash=expected_hash, segments=segments, session=session)
 
     if os.path.isdir(path):   
         print(f"Scan folder: {path}")
@@ -74,22 +88,24 @@ async def install_nodes_git(repo_url: str, nodes_path: Path):
     print(f"Repository {repo_url} successfully cloned into {repo.working_tree_dir}")
 
 
-async def install(invoke: Invoke, invoke_path: Path, builder_path: Path, config: ConfigInstall): 
+async def install(invoke: Invoke, invoke_path: Path, builder_path: Path, config: ConfigInstall, segments: int = 1): 
     temp_path = builder_path / ".temp"
     nodes_path = invoke_path / "nodes"
 
     if not os.path.exists(nodes_path):
         os.makedirs(nodes_path)
 
-    for path in config.copy:
-        print("Copy files")
-        await copy_files(path, invoke_path, temp_path)
-        print("All files copied")
+    # One HTTP session for every download of the install
+    async with FileManager.create_session() as session:
+        for path in config.copy:
+            print("Copy files")
+            await copy_files(path, invoke_path, temp_path, session, segments)
+            print("All files copied")
 
-    for path in config.models:
-        print("Install models")
-        await invoke.models.prune_completed_jobs()
-        await install_model(invoke, path, temp_path)
+        for path in config.models:
+            print("Install models")
+            await invoke.models.prune_completed_jobs()
+            await install_model(invoke, path, temp_path, session, segments)
 
     if config.models:
         print("Wait install models...")
@@ -120,6 +136,8 @@ async def main():
     parser.add_argument("--config", type=str, required=False)
     parser.add_argument("--invoke", type=str, required=True)
     parser.add_argument("--builder", type=str, required=True)
+    # Parallel range requests per download, for servers that support them
+    parser.add_argument("--segments", type=int, default=1)
     args = parser.parse_args()
     config = ConfigInstall(args.config)
     invoke_path = Path(args.invoke).resolve()
@@ -141,7 +159,8 @@ async def main():
             invoke=invoke, 
             invoke_path=invoke_path, 
             builder_path=builder_path, 
-            config=config
+            config=config,
+            segments=args.segments
         )
         print(f"==== Install done ====")
 
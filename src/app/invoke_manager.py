@@ -1,20 +1,42 @@
 import os
+import json
 import yaml
+import asyncio
+import hashlib
 from pathlib import Path
 import shutil
 import git
-import subprocess
 from runpod import RunPodLogger
-from typing import Optional, Dict, Any, List
+from contextlib import AsyncExitStack
+from typing import Optional, Dict, Any, List, Tuple
 from invoke import Invoke
-from .schema import ModelInfo, NodeInfo
+from invoke.api.models import ModelRecord, ModelInstallJobStatus
+from .schema import ModelInfo, NodeInfo, Manifest
 from .stale_portaLock import StalePortaLock
+from .db_sync import DbSync
+from .model_hasher import ModelHasher
+from .model_registry import ModelRegistry
+from .model_cache import ModelCache
+from .download_cache import DownloadCache
+from .node_deps import NodeDeps
 
 log = RunPodLogger()
 
+LOCK_STALE_THRESHOLD = 60 * 2
+
 
 class InvokeManager:
-    def __init__(self, invoke_path: Path, storage_path: Optional[Path] = None):
+    def __init__(
+        self, 
+        invoke_path: Path, 
+        storage_path: Optional[Path] = None, 
+        model_install_concurrency: int = 4, 
+        model_hash_workers: int = 4,
+        model_cache_path: Optional[Path] = None,
+        model_cache_size: int = 0,
+        download_cache_size: int = 0,
+        download_cache_interval: float = 60
+    ):
         if not storage_path:
             storage_path = invoke_path
 
@@ -23,91 +45,383 @@ class InvokeManager:
 
         self.invoke_path = invoke_path.resolve()
         self.storage_path = storage_path.resolve()
-
-        self.lock = StalePortaLock(self.storage_path, stale_threshold=60 * 10)
-        self.lock.timeout = 30
+        self.model_install_concurrency = max(1, model_install_concurrency)
 
         self.invoke_db_path = (self.invoke_path / "databases")
         self.storage_db_path = (self.storage_path / "databases")
         self.models_path = (self.storage_path / "models")
         self.nodes_path = (self.storage_path / "nodes")
         self.download_cache_path = (self.storage_path / "download_cache")
+        self.locks_path = (self.storage_path / ".locks")
+        self.installs_path = (self.storage_path / ".installs")
+        self.node_deps_path = (self.storage_path / "node_deps")
+        self.manifest_path = (self.storage_path / "manifest.json")
+        # Last manifest read or written, so jobs with nothing new skip the volume lock
+        self.manifest: Optional[Manifest] = None
+        self.templates_path = (self.storage_path / "templates")
 
         os.makedirs(self.invoke_db_path, exist_ok=True)
         os.makedirs(self.storage_db_path, exist_ok=True)
+        os.makedirs(self.locks_path, exist_ok=True)
+        os.makedirs(self.installs_path, exist_ok=True)
+
+        self.registry = ModelRegistry()
+        # Local copies of volume models; nothing to gain when models already live on local disk
+        self.model_cache = ModelCache(
+            cache_path=(model_cache_path if model_cache_path else self.invoke_path / "model_cache").resolve(),
+            models_path=self.models_path,
+            registry=self.registry,
+            max_bytes=model_cache_size if self.is_storage_use() else 0
+        )
+        self.db_sync = DbSync(
+            self.invoke_db_path / "invokeai.db", 
+            self.storage_db_path / "invokeai.db", 
+            local_models_path=self.model_cache.cache_path if self.model_cache.is_enabled() else None
+        )
+        self.node_deps = NodeDeps(self.invoke_path / ".venv", self.nodes_path, self.node_deps_path)
+        self.hasher = ModelHasher(cache_path=self.storage_path / ".hash_cache.json", workers=model_hash_workers)
+        self.download_cache = DownloadCache(
+            cache_path=self.download_cache_path,
+            hasher=self.hasher,
+            lock=self.get_lock("download_cache", "index", timeout=30),
+            max_bytes=download_cache_size,
+            interval=download_cache_interval
+        )
 
 
-    async def install_models(self, models: Optional[List[ModelInfo]]):
+    async def install_models(self, invoke: Invoke, models: Optional[List[ModelInfo]]) -> bool:
+        # True when a model was installed, deleted or renamed, i.e. the DB needs saving
         if not models:
-            return
+            return False
         
-        try:
-            async with Invoke() as invoke:
-                all_models = await invoke.models.list()
+        await self.registry.load(invoke)
+        requested = {model.source: model for model in models}
+        missing = [source for source in requested if not self._find_model(source)]
+
+        # Installed models pinned by hash must still match it (republished or damaged files)
+        changed = await self._verify_models([model for model in requested.values() if model.hash and model.source not in missing])
+        for model, record in changed:
+            if not model.update:
+                raise ValueError(f"Model '{model.source}' does not match hash {model.hash}, set update to reinstall it")
+            log.log(f"Reinstall changed model: {model.source}")
+            await self.model_cache.drop(invoke, record.key)
+            await invoke.models.delete(record.key)
+            self._clear_installed_path(model.source)
+            missing.append(model.source)
+
+        if missing:
+            self.registry.invalidate()
+            log.info(f"Install {len(missing)} models...")
+            await invoke.models.prune_completed_jobs()
+            semaphore = asyncio.Semaphore(self.model_install_concurrency)
+            results = await asyncio.gather(
+                *[self._install_model(invoke, source, semaphore) for source in missing],
+                return_exceptions=True
+            )
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+
+            await self.registry.load(invoke)
+            invalid = await self._verify_models([requested[source] for source in missing if requested[source].hash])
+            for model, record in invalid:
+                await self.model_cache.drop(invoke, record.key)
+                await invoke.models.delete(record.key)
+                self._clear_installed_path(model.source)
+            if invalid:
+                self.registry.invalidate()
+                raise ValueError(f"Installed models do not match their hash: {', '.join(model.source for model, _ in invalid)}")
+            log.info("All models installed")
+
+        renamed = False
+        for model in requested.values():
+            result = self._find_model(model.source)
+            if model.name and result.name != model.name:
+                log.log(f"Rename model: {result.name} -> {model.name}")
+                self.registry.invalidate()
+                await invoke.models.update(result.key, name=model.name)
+                renamed = True
+
+        return len(missing) > 0 or renamed
 
+
+    async def _install_model(self, invoke: Invoke, source: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            async with AsyncExitStack() as stack:
+                # Single-flight: one worker downloads a source, the rest register its files
                 if self.is_storage_use():
-                    self.lock.acquire()
-                
-                for model in models:
-                    if not any(m.source == model.source for m in all_models):
-                        log.log(f"Install model from: {model.source}")
-                        await invoke.models.install(model.source, inplace=True)
-
-                log.info("Wait install models...")
-                await invoke.models.prune_completed_jobs()
-                await invoke.wait_install_models(raise_on_error=True)
-                log.info("All models installed")
-
-                models_with_name = [model for model in models if model.name]
-                if models_with_name:
-                    all_models = await invoke.models.list()
-                    for model in models_with_name:
-                        result = next((m for m in all_models if (m.source == model.source)), None)
-                        if result.name != model.name:
-                            log.log(f"Rename model: {result.name} -> {model.name}")
-                            await invoke.models.update(result.key, name=model.name)
+                    await stack.enter_async_context(self.get_lock("model", source))
 
+                install_source = source
+                installed_path = self._get_installed_path(source)
+                if installed_path:
+                    log.log(f"Register model installed by another worker: {source} -> {installed_path}")
+                    install_source = installed_path.as_posix()
+                else:
+                    log.log(f"Install model from: {source}")
+
+                job = await invoke.models.install(install_source, inplace=True)
+                await invoke.wait_install_models(ids=[job.id], raise_on_error=True)
+                job = await invoke.models.get_install_job(str(job.id))
+                if job.status != ModelInstallJobStatus.completed:
+                    raise RuntimeError(f"Model install {job.status.value}: {source}")
+
+                if self.is_storage_use() and not installed_path and job.config_out and job.config_out.path:
+                    self._set_installed_path(source, job.config_out.path)
+
+
+    async def _verify_models(self, models: List[ModelInfo]) -> List[Tuple[ModelInfo, ModelRecord]]:
+        # Hashes are cached by (path, size, mtime), so only new or touched files are read
+        mismatched = []
+        items = []
+        for model in models:
+            record = self._find_model(model.source)
+            path = self._get_model_path(record)
+            if path.exists():
+                items.append((model, record, path))
+            else:
+                log.warn(f"Model files missing: {path}")
+                mismatched.append((model, record))
+        if not items:
+            return mismatched
+
+        hashes = await asyncio.to_thread(
+            self.hasher.hash_models, 
+            [(path, ModelHasher.parse_hash(model.hash)[0]) for model, _, path in items]
+        )
+        for (model, record, path), digest in zip(items, hashes):
+            if digest != ModelHasher.parse_hash(model.hash)[1]:
+                log.warn(f"Model hash mismatch: {model.source} ({path}) is {digest}, expected {model.hash}")
+                mismatched.append((model, record))
+        return mismatched
+
+
+    def _get_model_path(self, record: ModelRecord) -> Path:
+        path = Path(record.path)
+        if not path.is_absolute():
+            path = self.models_path / path
+        return self.model_cache.get_source_path(path)
 
-        finally:
-            self.lock.release()      
 
+    def _find_model(self, source: str) -> Optional[ModelRecord]:
+        # Models registered from another worker's files carry the local path as their source
+        model = self.registry.by_source.get(source)
+        if not model:
+            installed_path = self._get_installed_path(source)
+            if installed_path:
+                model = self.registry.by_source.get(installed_path.as_posix())
+        return model
 
-    async def install_nodes(self, nodes: Optional[List[NodeInfo]]):
+
+    def _get_install_record_path(self, source: str) -> Path:
+        return self.installs_path / f"{self._key_digest(source)}.json"
+
+
+    def _get_installed_path(self, source: str) -> Optional[Path]:
+        try:
+            with open(self._get_install_record_path(source), "r") as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        path = Path(record.get("path", ""))
+        if record.get("source") != source or not path.exists():
+            return None
+        return path
+
+
+    def _clear_installed_path(self, source: str):
+        self._get_install_record_path(source).unlink(missing_ok=True)
+
+
+    def _set_installed_path(self, source: str, path: str):
+        model_path = Path(path)
+        if not model_path.is_absolute():
+            model_path = self.models_path / model_path
+        record_path = self._get_install_record_path(source)
+        temp_path = record_path.with_name(record_path.name + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump({"source": source, "path": model_path.as_posix()}, f)
+        os.replace(temp_path, record_path)
+
+
+    async def install_nodes(self, nodes: Optional[List[NodeInfo]]) -> bool:
         if not nodes:
-            return
+            return False
         
-        need_reload = False
-        try:
+        results = await asyncio.gather(
+            *[self._install_node(node) for node in {node.git: node for node in nodes}.values()],
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+
+        changed_paths = [path for path in results if path]
+        if changed_paths:
+            await asyncio.to_thread(self.sync_node_deps)
+
+        return len(changed_paths) > 0
+
+
+    def sync_node_deps(self):
+        # All nodes' requirements resolved once into a shared overlay; InvokeAI sees it on (re)start
+        requirements = self.node_deps.get_requirements()
+        if not requirements:
+            self.node_deps.link(None)
+            return
+        if not self.node_deps.is_available():
+            log.error(f"Node dependencies skipped: no site-packages in {self.node_deps.venv_path}")
+            return
+
+        fingerprint = self.node_deps.fingerprint(requirements)
+        if not self.node_deps.is_built(fingerprint):
+            with self.get_lock("node-deps", fingerprint):
+                if not self.node_deps.is_built(fingerprint):
+                    self.node_deps.build(fingerprint, requirements)
+        self.node_deps.link(fingerprint)
+
+
+    async def _install_node(self, node: NodeInfo) -> Optional[Path]:
+        repo_name = node.git.rstrip('/').split('/')[-1].replace('.git', '')
+        target_path = self.nodes_path / repo_name
+        async with AsyncExitStack() as stack:
             if self.is_storage_use():
-                self.lock.acquire()
-                
-            for node in nodes:
-                repo_name = node.git.rstrip('/').split('/')[-1].replace('.git', '')
-                target_path = self.nodes_path / repo_name
-                if not target_path.exists():
-                    need_reload = True
-                    target_path.mkdir(parents=True, exist_ok=True)
-                    repo = git.Repo.clone_from(node.git, target_path)
-                    log.info(f"Repository {node.git} successfully cloned into {repo.working_tree_dir}")
-
-                    requirements_path = target_path / "requirements.txt"
-                    if requirements_path.exists():
-                        activate_path = self.invoke_path / ".venv/bin/activate"
-                        command = f"source {activate_path} && uv pip install -r {requirements_path}"
-                        log.info(f"> {command}")
-                        result = subprocess.run(command, shell=True, check=True, executable="/bin/bash")
-                        log.log(result.stdout)
+                await stack.enter_async_context(self.get_lock("node", repo_name))
+
+            if not target_path.exists():
+                await asyncio.to_thread(self._clone_node, node, target_path)
+                return target_path
+
+            if await asyncio.to_thread(self._update_node, node, target_path):
+                return target_path
+        return None
+
 
+    def _clone_node(self, node: NodeInfo, target_path: Path):
+        # Shallow fetch of just the wanted commit, into a temp dir so a failed clone leaves nothing behind
+        temp_path = target_path.with_name(f"{target_path.name}.clone-{os.getpid()}")
+        shutil.rmtree(temp_path, ignore_errors=True)
+        try:
+            repo = git.Repo.init(temp_path)
+            repo.create_remote("origin", node.git)
+            self._fetch_node(repo, node)
+            os.rename(temp_path, target_path)
         finally:
-            self.lock.release()
+            shutil.rmtree(temp_path, ignore_errors=True)
+        log.info(f"Repository {node.git} cloned into {target_path} at {node.commit or 'HEAD'}")
+
+
+    def _update_node(self, node: NodeInfo, target_path: Path) -> bool:
+        # A pinned commit is checked out when it differs; update also follows a moving ref
+        repo = git.Repo(target_path)
+        current = repo.head.commit.hexsha
+        if node.commit and not node.update:
+            with repo.config_reader() as config:
+                checked_out_ref = config.get_value("worker", "ref", default="")
+            if checked_out_ref == node.commit or current.startswith(node.commit.lower()):
+                return False
+        elif not node.update:
+            return False
+
+        self._fetch_node(repo, node)
+        if repo.head.commit.hexsha == current:
+            return False
+        log.info(f"Repository {node.git} updated {current[:8]} -> {repo.head.commit.hexsha[:8]}")
+        return True
+
+
+    def _fetch_node(self, repo: git.Repo, node: NodeInfo):
+        ref = node.commit or "HEAD"
+        try:
+            repo.git.fetch("origin", ref, depth=1)
+        except git.GitCommandError:
+            # Servers that refuse fetching a bare SHA need the full history
+            if (Path(repo.git_dir) / "shallow").exists():
+                repo.git.fetch("origin", "--tags", "--unshallow")
+            else:
+                repo.git.fetch("origin", "--tags")
+            repo.git.checkout("--force", ref)
+        else:
+            repo.git.checkout("--force", "FETCH_HEAD")
+        with repo.config_writer() as config:
+            config.set_value("worker", "ref", ref)
+
+
+    def load_manifest(self) -> Manifest:
+        self.manifest = Manifest()
+        if not self.manifest_path.is_file():
+            return self.manifest
+        try:
+            self.manifest = Manifest.model_validate_json(self.manifest_path.read_text())
+        except Exception as e:
+            log.error(f"Failed to read manifest {self.manifest_path}: {e}")
+        return self.manifest
+
+
+    def update_manifest(self, nodes: Optional[List[NodeInfo]], models: Optional[List[ModelInfo]]):
+        # Everything a job needed is recorded so the next boot prepares it before InvokeAI starts
+        if not nodes and not models:
+            return
+        try:
+            manifest = self.manifest if self.manifest is not None else self.load_manifest()
+            if self._merge_manifest(manifest, nodes, models) == manifest:
+                return
 
-        return need_reload
+            # Something new: merge into the current file, other workers may have added entries
+            with self.get_lock("manifest", "manifest.json", timeout=30):
+                manifest = self.load_manifest()
+                updated = self._merge_manifest(manifest, nodes, models)
+                if updated == manifest:
+                    return
+                temp_path = self.manifest_path.with_name(f"{self.manifest_path.name}.{os.getpid()}.tmp")
+                temp_path.write_text(updated.model_dump_json(indent=2))
+                os.replace(temp_path, self.manifest_path)
+                self.manifest = updated
+            log.info(f"Manifest updated: {len(updated.nodes)} nodes, {len(updated.models)} models")
+        except Exception as e:
+            # Only the next boot's preparation depends on it, not this job
+            log.error(f"Failed to update manifest {self.manifest_path}: {e}")
+
+
+    @staticmethod
+    def _merge_manifest(manifest: Manifest, nodes: Optional[List[NodeInfo]], models: Optional[List[ModelInfo]]) -> Manifest:
+        all_nodes = {node.git: node for node in manifest.nodes}
+        all_nodes.update({node.git: node for node in nodes or []})
+        all_models = {model.source: model for model in manifest.models}
+        # Tokens stay out of the shared volume
+        all_models.update({model.source: model.model_copy(update={"access_token": None}) for model in models or []})
+        return Manifest(nodes=list(all_nodes.values()), models=list(all_models.values()))
+
+
+    async def apply_manifest_nodes(self) -> bool:
+        # Boot time: clone/update manifest nodes while InvokeAI is not running yet
+        manifest = self.load_manifest()
+        if not manifest.nodes:
+            return False
+        log.info(f"Apply manifest: {len(manifest.nodes)} nodes")
+        try:
+            return await self.install_nodes(manifest.nodes)
+        except Exception as e:
+            # A broken node must not keep the worker from starting
+            log.error(f"Failed to apply manifest nodes: {e}")
+            return False
 
 
     def is_storage_use(self):
         return self.invoke_path != self.storage_path
 
 
+    def get_lock(self, kind: str, key: str, shared: bool = False, timeout: Optional[float] = None) -> StalePortaLock:
+        # Per-resource lock on the storage volume, kept alive by a heartbeat while held
+        lock = StalePortaLock(self.locks_path, stale_threshold=LOCK_STALE_THRESHOLD, name=f"{kind}-{self._key_digest(key)}", shared=shared)
+        lock.timeout = timeout
+        return lock
+
+
+    def _key_digest(self, key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
     def init_config(self, user_config: Optional[Dict[str, Any]] = None):
         self._set_config({
             "db_dir": self.invoke_db_path.as_posix(),
@@ -117,36 +431,43 @@ class InvokeManager:
         }, user_config)
 
 
+    def get_outputs_images_path(self) -> Path:
+        outputs_path = Path(self._get_config().get("outputs_dir", "outputs"))
+        if not outputs_path.is_absolute():
+            outputs_path = self.invoke_path / outputs_path
+        return outputs_path / "images"
+
+
     def load_db(self):
         if not self.is_storage_use():
             return
         
         log.info("External storage is used")
-        self.lock.acquire()
-        try:
+        with self.get_lock("db", "invokeai.db", shared=True, timeout=30):
             # sync: storage -> invoke
-            storage_db_path = self.storage_db_path / "invokeai.db"
-            invoke_db_path = self.invoke_db_path / "invokeai.db"
-            if storage_db_path.is_file():
-                log.info(f"Sync: storage ({storage_db_path}) -> invoke ({storage_db_path})")
-                shutil.copy2(storage_db_path, invoke_db_path)
-        finally:
-            self.lock.release()
+            self.db_sync.pull()
     
 
     def save_db(self):
         if not self.is_storage_use():
             return
         
-        self.lock.acquire()
-        try:
+        # Nothing written since the last sync, skip the snapshot and the lock
+        if not self.db_sync.is_local_changed():
+            return
+
+        snapshot = self.db_sync.snapshot()
+        with self.get_lock("db", "invokeai.db", timeout=30):
             # sync: storage <- invoke
-            storage_db_path = self.storage_db_path / "invokeai.db"
-            invoke_db_path = self.invoke_db_path / "invokeai.db"
-            log.info(f"Sync: storage ({storage_db_path}) <- invoke ({storage_db_path})")
-            shutil.copy2(invoke_db_path, storage_db_path)
-        finally:
-            self.lock.release()
+            self.db_sync.push(snapshot)
+
+
+    def _get_config(self) -> Dict[str, Any]:
+        path: Path = self.invoke_path / "invokeai.yaml"
+        if not path.is_file():
+            return {}
+        with open(path, "r") as yaml_file:
+            return yaml.safe_load(yaml_file) or {}
 
 
     def _set_config(self, config: Dict[str, Any], user_merge: Optional[Dict[str, Any]] = None):
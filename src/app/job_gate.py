@@ -0,0 +1,44 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class JobGate:
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._active = 0
+        self._exclusive = False
+        self._waiting_exclusive = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @asynccontextmanager
+    async def shared(self):
+        # Jobs run side by side, but wait while a restart is pending
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._exclusive and not self._waiting_exclusive)
+            self._active += 1
+        try:
+            yield self
+        finally:
+            async with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self):
+        # Drain running jobs (e.g. before restarting InvokeAI)
+        async with self._condition:
+            self._waiting_exclusive += 1
+            try:
+                await self._condition.wait_for(lambda: not self._exclusive and self._active == 0)
+            finally:
+                self._waiting_exclusive -= 1
+            self._exclusive = True
+        try:
+            yield self
+        finally:
+            async with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
\ No newline at end of file
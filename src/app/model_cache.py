@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+from pathlib import Path
+from typing import Optional, Dict, List
+from pydantic import BaseModel
+from runpod import RunPodLogger
+from invoke import Invoke
+from invoke.api.models import ModelRecord
+from .model_registry import ModelRegistry
+
+log = RunPodLogger()
+
+
+class CachedModel(BaseModel):
+    relative_path: str
+    size: int
+    last_used: float
+
+
+class ModelCache:
+    def __init__(self, cache_path: Path, models_path: Path, registry: ModelRegistry, max_bytes: int = 0):
+        self.cache_path = cache_path
+        self.models_path = models_path
+        self.registry = registry
+        self.max_bytes = max_bytes
+        self.index_path = cache_path / "index.json"
+        self._entries: Dict[str, CachedModel] = {}
+        self._pins: Dict[str, int] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+        if self.is_enabled():
+            os.makedirs(self.cache_path, exist_ok=True)
+            self._load_index()
+
+
+    def is_enabled(self) -> bool:
+        return self.max_bytes > 0
+
+
+    def get_local_path(self, relative_path: str) -> Path:
+        return self.cache_path / relative_path
+
+
+    def get_source_path(self, path: Path) -> Path:
+        # A local copy maps back to its file on the volume (hashes, installs and deletes work on that one)
+        if self.is_enabled() and path.is_relative_to(self.cache_path):
+            return self.models_path / path.relative_to(self.cache_path)
+        return path
+
+
+    async def drop(self, invoke: Invoke, key: str):
+        # Before a model is deleted: point it back to the volume so InvokeAI removes the real files
+        async with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return
+            await invoke.models.update(key, path=entry.relative_path)
+            self._remove_local(key)
+            self.registry.invalidate()
+
+
+    def use(self, invoke: Invoke, records: List[ModelRecord]) -> List[str]:
+        # Pin the job's models and copy the ones still on the volume in the background
+        if not self.is_enabled():
+            return []
+        keys = []
+        for record in records:
+            keys.append(record.key)
+            self._pins[record.key] = self._pins.get(record.key, 0) + 1
+            entry = self._entries.get(record.key)
+            if entry:
+                entry.last_used = time.time()
+            elif record.key not in self._tasks and self._get_relative_path(record):
+                self._tasks[record.key] = asyncio.create_task(self._cache_model(invoke, record))
+        return keys
+
+
+    def release(self, keys: List[str]):
+        for key in keys:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            else:
+                self._pins.pop(key, None)
+
+
+    async def prefetch(self, invoke: Invoke, names: List[str]):
+        # Boot time: copy the listed models (by name or source) before the first job
+        if not self.is_enabled() or not names:
+            return
+        await self.registry.load(invoke)
+        records = []
+        for name in names:
+            record = self.registry.by_source.get(name) or self.registry.find(name)
+            if record:
+                records.append(record)
+            else:
+                log.warn(f"Model cache prefetch: model not found '{name}'")
+        for record in records:
+            if record.key not in self._entries and self._get_relative_path(record):
+                await self._cache_model(invoke, record)
+
+
+    async def restore(self, invoke: Invoke):
+        # The DB synced from the volume points at the volume; point cached models back to local copies
+        if not self.is_enabled() or not self._entries:
+            return
+        await self.registry.load(invoke)
+        restored = 0
+        for key, entry in list(self._entries.items()):
+            record = self.registry.by_key.get(key)
+            local_path = self.get_local_path(entry.relative_path)
+            if not record or not local_path.exists():
+                self._remove_local(key)
+                continue
+            if Path(record.path) != local_path:
+                await invoke.models.update(key, path=local_path.as_posix())
+                restored += 1
+        if restored:
+            self.registry.invalidate()
+        self._save_index()
+        log.info(f"Model cache: {len(self._entries)} models on local disk, {restored} restored")
+
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "items": len(self._entries),
+            "bytes": sum(entry.size for entry in self._entries.values()),
+            "copying": len(self._tasks)
+        }
+
+
+    async def _cache_model(self, invoke: Invoke, record: ModelRecord):
+        try:
+            relative_path = self._get_relative_path(record)
+            source_path = self.models_path / relative_path
+            size = await asyncio.to_thread(self._get_size, source_path)
+            if size > self.max_bytes:
+                log.warn(f"Model cache: {record.name} ({size} bytes) exceeds the cache size")
+                return
+
+            async with self._lock:
+                if not await self._evict(invoke, size):
+                    log.warn(f"Model cache: no room for {record.name}, models in use")
+                    return
+
+                # One copy at a time, so a cold job's model loads are not starved of bandwidth
+                log.info(f"Model cache: copy {record.name} ({size} bytes) to local disk")
+                local_path = self.get_local_path(relative_path)
+                await asyncio.to_thread(self._copy, source_path, local_path)
+                await invoke.models.update(record.key, path=local_path.as_posix())
+                self._entries[record.key] = CachedModel(relative_path=relative_path, size=size, last_used=time.time())
+                self.registry.invalidate()
+                self._save_index()
+        except Exception as e:
+            log.error(f"Model cache: failed to cache {record.name}: {e}")
+        finally:
+            self._tasks.pop(record.key, None)
+
+
+    async def _evict(self, invoke: Invoke, size: int) -> bool:
+        # Least recently used first, never a model a running job pinned
+        used = sum(entry.size for entry in self._entries.values())
+        candidates = sorted(
+            (key for key in self._entries if key not in self._pins),
+            key=lambda key: self._entries[key].last_used
+        )
+        while used + size > self.max_bytes:
+            if not candidates:
+                return False
+            key = candidates.pop(0)
+            entry = self._entries[key]
+            log.info(f"Model cache: evict {entry.relative_path}")
+            try:
+                await invoke.models.update(key, path=entry.relative_path)
+            except Exception as e:
+                log.warn(f"Model cache: failed to point {key} back to the volume: {e}")
+            self._remove_local(key)
+            self.registry.invalidate()
+            used -= entry.size
+        return True
+
+
+    def _get_relative_path(self, record: ModelRecord) -> Optional[str]:
+        # Only models stored in the volume's models dir are cached
+        path = Path(record.path)
+        if not path.is_absolute():
+            return path.as_posix()
+        if path.is_relative_to(self.cache_path):
+            return None
+        if path.is_relative_to(self.models_path):
+            return path.relative_to(self.models_path).as_posix()
+        return None
+
+
+    def _remove_local(self, key: str):
+        entry = self._entries.pop(key, None)
+        if not entry:
+            return
+        local_path = self.get_local_path(entry.relative_path)
+        if local_path.is_dir():
+            shutil.rmtree(local_path, ignore_errors=True)
+        elif local_path.exists():
+            local_path.unlink()
+        self._save_index()
+
+
+    @staticmethod
+    def _get_size(path: Path) -> int:
+        if path.is_file():
+            return path.stat().st_size
+        return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+    @staticmethod
+    def _copy(source_path: Path, local_path: Path):
+        os.makedirs(local_path.parent, exist_ok=True)
+        temp_path = local_path.with_name(f"{local_path.name}.copy-{os.getpid()}")
+        try:
+            if source_path.is_dir():
+                shutil.copytree(source_path, temp_path)
+            else:
+                shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, local_path)
+        finally:
+            if temp_path.is_dir():
+                shutil.rmtree(temp_path, ignore_errors=True)
+            elif temp_path.exists():
+                temp_path.unlink()
+
+
+    def _load_index(self):
+        if not self.index_path.is_file():
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            self._entries = {key: CachedModel.model_validate(value) for key, value in data.items()}
+        except Exception as e:
+            log.error(f"Failed to read model cache index {self.index_path}: {e}")
+
+
+    def _save_index(self):
+        temp_path = self.index_path.with_name(f"{self.index_path.name}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump({key: entry.model_dump() for key, entry in self._entries.items()}, f)
+        os.replace(temp_path, self.index_path)
\ No newline at end of file
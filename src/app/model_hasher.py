@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple, Any
+from runpod import RunPodLogger
+
+log = RunPodLogger()
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Weight files InvokeAI hashes inside a diffusers-style model folder
+MODEL_FILE_SUFFIXES = {".ckpt", ".safetensors", ".bin", ".pt", ".pth"}
+
+
+class ModelHasher:
+    def __init__(self, cache_path: Optional[Path] = None, workers: int = 4):
+        self.cache_path = cache_path
+        self.workers = max(1, workers)
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cache_lock = threading.Lock()
+        self._load_cache()
+
+
+    @staticmethod
+    def parse_hash(value: str) -> Tuple[str, str]:
+        # "blake3:<hex>" like InvokeAI records, "sha256:<hex>", or a bare sha256 hex digest
+        if ":" in value:
+            algorithm, digest = value.split(":", 1)
+            return algorithm.lower(), digest.lower()
+        return "sha256", value.lower()
+
+
+    def hash_models(self, items: List[Tuple[Path, str]]) -> List[str]:
+        # Every weight file of every model goes through one pool, so a set of models hashes in parallel
+        components = [self._get_components(path) for path, _ in items]
+        jobs = {(file, algorithm) for files, (_, algorithm) in zip(components, items) for file in files}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            hashes = dict(zip(jobs, executor.map(lambda job: self._hash_file_cached(*job), jobs)))
+        self._save_cache()
+
+        results = []
+        for files, (path, algorithm) in zip(components, items):
+            if path.is_file():
+                results.append(hashes[(files[0], algorithm)])
+                continue
+            # Folder hash: the algorithm over the sorted component digests, as InvokeAI does
+            composite = self._new_hasher(algorithm)
+            for file in files:
+                composite.update(hashes[(file, algorithm)].encode("utf-8"))
+            results.append(composite.hexdigest())
+        return results
+
+
+    def _get_components(self, path: Path) -> List[Path]:
+        if path.is_file():
+            return [path]
+        if not path.is_dir():
+            raise FileNotFoundError(f"Model path not found: {path}")
+        return sorted(file for file in path.rglob("*") if file.is_file() and file.suffix.lower() in MODEL_FILE_SUFFIXES)
+
+
+    def _hash_file_cached(self, path: Path, algorithm: str) -> str:
+        stat = path.stat()
+        key = f"{algorithm}:{path.resolve().as_posix()}"
+        with self._cache_lock:
+            entry = self._cache.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["hash"]
+
+        log.info(f"Hash {path} ({stat.st_size} bytes)")
+        digest = self._hash_file(path, algorithm)
+        with self._cache_lock:
+            self._cache[key] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest}
+        return digest
+
+
+    def _hash_file(self, path: Path, algorithm: str) -> str:
+        hasher = self._new_hasher(algorithm)
+        if hasattr(hasher, "update_mmap"):
+            # blake3 hashes a mapped file on all cores
+            hasher.update_mmap(path)
+            return hasher.hexdigest()
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+
+    @staticmethod
+    def _new_hasher(algorithm: str) -> Any:
+        if algorithm == "blake3":
+            from blake3 import blake3
+            return blake3(max_threads=blake3.AUTO)
+        return hashlib.new(algorithm)
+
+
+    def _load_cache(self):
+        if not self.cache_path or not self.cache_path.is_file():
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                self._cache.update(json.load(f))
+        except Exception as e:
+            log.error(f"Failed to read hash cache {self.cache_path}: {e}")
+
+
+    def _save_cache(self):
+        # Merge with what other workers wrote, then replace the file atomically
+        if not self.cache_path:
+            return
+        try:
+            with self._cache_lock:
+                entries = dict(self._cache)
+                self._cache.clear()
+                self._load_cache()
+                self._cache.update(entries)
+                data = dict(self._cache)
+            temp_path = self.cache_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.cache_path)
+        except Exception as e:
+            log.error(f"Failed to write hash cache {self.cache_path}: {e}")
\ No newline at end of file
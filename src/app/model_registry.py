@@ -0,0 +1,95 @@
+import asyncio
+from typing import Optional, Dict, List, Tuple
+from runpod import RunPodLogger
+from invoke import Invoke
+from invoke.api.models import ModelRecord
+from invoke.graph_builder.components import Graph
+
+log = RunPodLogger()
+
+# Loader nodes and the field holding their model reference (as in Batch.update_models_hash)
+MODEL_FIELDS = {
+    "main_model_loader": "model",
+    "sdxl_model_loader": "model",
+    "lora_selector": "lora",
+    "controlnet": "control_model",
+    "vae_loader": "vae_model",
+}
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.records: Optional[List[ModelRecord]] = None
+        self.by_source: Dict[str, ModelRecord] = {}
+        self.by_key: Dict[str, ModelRecord] = {}
+        self.by_name: Dict[str, List[ModelRecord]] = {}
+        self.by_identity: Dict[Tuple[str, str, str], ModelRecord] = {}
+        # Bumped on every reload, so graphs resolved earlier know to resolve again
+        self.generation = 0
+        self._lock = asyncio.Lock()
+
+
+    def invalidate(self):
+        # Call after anything that adds, removes or renames models
+        self.records = None
+
+
+    async def load(self, invoke: Invoke) -> "ModelRegistry":
+        if self.records is not None:
+            return self
+        async with self._lock:
+            if self.records is None:
+                records = await invoke.models.list()
+                self._build(records)
+                log.debug(f"Model registry loaded: {len(records)} models")
+        return self
+
+
+    def find(self, name: str, base: Optional[str] = None, type: Optional[str] = None) -> Optional[ModelRecord]:
+        if base and type:
+            record = self.by_identity.get((base, type, name))
+            if record:
+                return record
+        records = self.by_name.get(name)
+        return records[0] if records else None
+
+
+    async def resolve_graph(self, invoke: Invoke, graph: Graph) -> List[ModelRecord]:
+        # Fill key/hash of every model reference; one reload if something is unknown
+        await self.load(invoke)
+        records = self._resolve(graph, raise_missing=False)
+        if records is None:
+            self.invalidate()
+            await self.load(invoke)
+            records = self._resolve(graph, raise_missing=True)
+        return records
+
+
+    def _resolve(self, graph: Graph, raise_missing: bool) -> Optional[List[ModelRecord]]:
+        records: Dict[str, ModelRecord] = {}
+        for node in graph.nodes.values():
+            field = MODEL_FIELDS.get(node["type"])
+            if not field:
+                continue
+            reference = node[field]
+            record = self.find(reference["name"], reference.get("base"), reference.get("type"))
+            if not record:
+                if raise_missing:
+                    raise Exception(f"Error updating hash for model '{reference['name']}': model not found")
+                return None
+            reference["key"] = record.key
+            reference["hash"] = record.hash
+            records[record.key] = record
+        return list(records.values())
+
+
+    def _build(self, records: List[ModelRecord]):
+        by_name: Dict[str, List[ModelRecord]] = {}
+        for record in records:
+            by_name.setdefault(record.name, []).append(record)
+        self.by_source = {record.source: record for record in records}
+        self.by_key = {record.key: record for record in records}
+        self.by_name = by_name
+        self.by_identity = {(record.base, record.type, record.name): record for record in records}
+        self.records = records
+        self.generation += 1
\ No newline at end of file
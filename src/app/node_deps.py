@@ -0,0 +1,104 @@
+import os
+import re
+import shutil
+import hashlib
+import subprocess
+from pathlib import Path
+from typing import Optional, List
+from runpod import RunPodLogger
+
+log = RunPodLogger()
+
+PTH_NAME = "invoke_node_deps.pth"
+
+
+class NodeDeps:
+    def __init__(self, venv_path: Path, nodes_path: Path, overlay_root: Path):
+        self.venv_path = venv_path
+        self.nodes_path = nodes_path
+        self.overlay_root = overlay_root
+
+
+    def is_available(self) -> bool:
+        return self._get_site_packages() is not None
+
+
+    def get_requirements(self) -> List[Path]:
+        # InvokeAI loads every node on the volume, so every node's requirements count
+        if not self.nodes_path.is_dir():
+            return []
+        return sorted(path for path in self.nodes_path.glob("*/requirements.txt") if path.is_file())
+
+
+    def fingerprint(self, requirements: List[Path]) -> str:
+        # Same node requirements on the same base venv resolve to the same overlay
+        hasher = hashlib.sha256()
+        pyvenv_path = self.venv_path / "pyvenv.cfg"
+        if pyvenv_path.is_file():
+            hasher.update(pyvenv_path.read_bytes())
+        site_packages = self._get_site_packages()
+        if site_packages:
+            hasher.update("\n".join(sorted(p.name for p in site_packages.glob("*.dist-info"))).encode())
+        for path in requirements:
+            hasher.update(path.parent.name.encode())
+            hasher.update(path.read_bytes())
+        return hasher.hexdigest()[:16]
+
+
+    def get_overlay_path(self, fingerprint: str) -> Path:
+        return self.overlay_root / fingerprint
+
+
+    def is_built(self, fingerprint: str) -> bool:
+        return (self.get_overlay_path(fingerprint) / ".complete").exists()
+
+
+    def build(self, fingerprint: str, requirements: List[Path]):
+        # Resolve against the InvokeAI venv, then put only what it lacks into the overlay
+        overlay_path = self.get_overlay_path(fingerprint)
+        temp_path = overlay_path.with_name(f"{overlay_path.name}.build-{os.getpid()}")
+        shutil.rmtree(temp_path, ignore_errors=True)
+        try:
+            packages = self._resolve_missing(requirements)
+            os.makedirs(temp_path, exist_ok=True)
+            if packages:
+                log.info(f"Install {len(packages)} node dependencies into {overlay_path}")
+                self._uv(["install", "--target", temp_path.as_posix(), "--no-deps", *packages])
+            (temp_path / ".complete").write_text("\n".join(packages))
+            os.rename(temp_path, overlay_path)
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+
+    def link(self, fingerprint: Optional[str]):
+        # A .pth in the venv puts the overlay ahead of site-packages on the next InvokeAI start
+        site_packages = self._get_site_packages()
+        if not site_packages:
+            return
+        pth_path = site_packages / PTH_NAME
+        if not fingerprint:
+            pth_path.unlink(missing_ok=True)
+            return
+        overlay_path = self.get_overlay_path(fingerprint).as_posix()
+        pth_path.write_text(f"import sys; sys.path.insert(1, {overlay_path!r})\n")
+        log.info(f"Node dependencies overlay: {overlay_path}")
+
+
+    def _resolve_missing(self, requirements: List[Path]) -> List[str]:
+        args = ["install", "--dry-run"]
+        for path in requirements:
+            args += ["-r", path.as_posix()]
+        output = self._uv(args)
+        # "Would install ..." is followed by " + name==version" lines
+        return [match.group(1).strip() for match in re.finditer(r"^\s*\+\s+(.+)$", output, re.MULTILINE)]
+
+
+    def _uv(self, args: List[str]) -> str:
+        command = ["uv", "pip", *args, "--python", (self.venv_path / "bin/python").as_posix()]
+        log.info(f"> {' '.join(command)}")
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+        return result.stdout + result.stderr
+
+
+    def _get_site_packages(self) -> Optional[Path]:
+        return next((self.venv_path / "lib").glob("python*/site-packages"), None)
\ No newline at end of file
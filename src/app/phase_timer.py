@@ -0,0 +1,57 @@
+import time
+import json
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict
+from runpod import RunPodLogger
+
+log = RunPodLogger()
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.start_time = time.perf_counter()
+        self.wall_start_time = time.time()
+
+    @contextmanager
+    def phase(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+    def mark(self, name: str):
+        # Milliseconds since the timer was created, the first mark wins
+        if name not in self.timings:
+            self.timings[name] = round((time.perf_counter() - self.start_time) * 1000, 2)
+
+    def add(self, name: str, seconds: float):
+        # Repeated phases accumulate, values are in milliseconds
+        self.timings[name] = round(self.timings.get(name, 0) + seconds * 1000, 2)
+        log.debug(f"Phase {name}: {self.timings[name]} ms")
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed(self) -> float:
+        # Wall clock, so it also spans timers handed over between processes
+        return time.time() - self.wall_start_time
+
+    def save(self, path: Path):
+        with open(path, "w") as f:
+            json.dump({"start_time": self.wall_start_time, "timings": self.timings}, f)
+
+    @staticmethod
+    def load(path: Path) -> "PhaseTimer":
+        timer = PhaseTimer()
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            timer.wall_start_time = data["start_time"]
+            timer.timings.update(data["timings"])
+        except (OSError, ValueError, KeyError):
+            pass
+        return timer
\ No newline at end of file
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from runpod import RunPodLogger
+from invoke.graph_builder.components import Graph
+from .schema import ImageInfo
+from .stale_portaLock import StalePortaLock
+
+log = RunPodLogger()
+
+# Nodes whose output changes between runs of the same graph
+RANDOM_NODE_TYPES = {"rand_int", "rand_float", "random_range", "dynamic_prompt"}
+
+
+class ResultCacheEntry(BaseModel):
+    images: List[ImageInfo]
+    created_at: float
+
+
+class ResultCache:
+    def __init__(
+        self, 
+        max_items: int = 0, 
+        ttl: float = 60 * 60 * 24, 
+        shared_path: Optional[Path] = None, 
+        shared_lock: Optional[StalePortaLock] = None
+    ):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.shared_path = shared_path
+        self.shared_lock = shared_lock
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, ResultCacheEntry]" = OrderedDict()
+        self._shared_mtime: Optional[float] = None
+        # One save at a time per worker; the storage lock orders the workers
+        self._save_lock = asyncio.Lock()
+
+
+    def is_enabled(self) -> bool:
+        return self.max_items > 0
+
+
+    @staticmethod
+    def make_key(graph: Graph, images: Optional[List[ImageInfo]] = None) -> Optional[str]:
+        # Graph must already carry the resolved model keys and hashes
+        data = graph.model_dump(mode="json")
+        if any(node.get("type") in RANDOM_NODE_TYPES for node in data["nodes"].values()):
+            return None
+        data.pop("id", None)
+        data["images"] = sorted(
+            (image.id, f"cdn:{image.cdn_id}" if image.cdn_id else hashlib.sha256((image.base64 or "").encode()).hexdigest())
+            for image in images or []
+        )
+        canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+    async def get(self, key: str) -> Optional[List[ImageInfo]]:
+        entry = self._entries.get(key)
+        if not entry and self.shared_path:
+            await self._load_shared()
+            entry = self._entries.get(key)
+
+        if entry and self._is_expired(entry):
+            self._entries.pop(key, None)
+            entry = None
+
+        if not entry:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return [image.model_copy() for image in entry.images]
+
+
+    async def put(self, key: str, images: List[ImageInfo]):
+        # Only bucket results are cached, base64 payloads are too large to keep
+        if not images or any(not image.cdn_id for image in images):
+            return
+        self._entries[key] = ResultCacheEntry(images=images, created_at=time.time())
+        self._entries.move_to_end(key)
+        self._evict()
+        if self.shared_path:
+            await self._save_shared()
+
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "items": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+    def _is_expired(self, entry: ResultCacheEntry) -> bool:
+        return self.ttl > 0 and time.time() - entry.created_at > self.ttl
+
+
+    def _evict(self):
+        for key in [key for key, entry in self._entries.items() if self._is_expired(entry)]:
+            self._entries.pop(key)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+
+    def _merge(self, entries: Dict[str, ResultCacheEntry]):
+        for key, entry in entries.items():
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._entries.move_to_end(key, last=False)
+        self._evict()
+
+
+    async def _load_shared(self):
+        # File access runs in a thread, the volume must not stall other jobs on the loop
+        try:
+            shared = await asyncio.to_thread(self._read_shared, self._shared_mtime)
+        except Exception as e:
+            log.error(f"Failed to read result cache {self.shared_path}: {e}")
+            return
+        if shared:
+            entries, self._shared_mtime = shared
+            self._merge(entries)
+
+
+    async def _save_shared(self):
+        # Merge with what other workers wrote, then replace the file atomically; locked so no merge is lost
+        async with self._save_lock:
+            try:
+                if self.shared_lock:
+                    await self.shared_lock.acquire_async()
+                try:
+                    shared = await asyncio.to_thread(self._read_shared, None)
+                    if shared:
+                        self._merge(shared[0])
+                    data = {key: entry.model_dump() for key, entry in self._entries.items()}
+                    self._shared_mtime = await asyncio.to_thread(self._write_shared, data)
+                finally:
+                    if self.shared_lock:
+                        self.shared_lock.release()
+            except Exception as e:
+                log.error(f"Failed to write result cache {self.shared_path}: {e}")
+
+
+    def _read_shared(self, known_mtime: Optional[float]) -> Optional[Tuple[Dict[str, ResultCacheEntry], float]]:
+        # None when the file is missing or unchanged since the last read
+        if not self.shared_path.is_file():
+            return None
+        mtime = self.shared_path.stat().st_mtime
+        if mtime == known_mtime:
+            return None
+        with open(self.shared_path, "r") as f:
+            data = json.load(f)
+        return {key: ResultCacheEntry.model_validate(value) for key, value in data.items()}, mtime
+
+
+    def _write_shared(self, data: Dict[str, dict]) -> float:
+        temp_path = self.shared_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.shared_path)
+        return self.shared_path.stat().st_mtime
\ No newline at end of file
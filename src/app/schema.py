@@ -1,10 +1,11 @@
 from pydantic import BaseModel
-from typing import List, Optional, Any
+from typing import List, Dict, Optional, Any
 
 
 class ImageData(BaseModel):
     data: Optional[bytes] = None
     download_url: Optional[str] = None
+    file_path: Optional[str] = None
     id: str
 
 
@@ -28,9 +29,18 @@ class ModelInfo(BaseModel):
     update: bool = False
 
 
+class Manifest(BaseModel):
+    nodes: List[NodeInfo] = []
+    models: List[ModelInfo] = []
+
+
 class JobTask(BaseModel):
     images: Optional[List[ImageInfo]] = None
-    graph: str
+    graph: Optional[str] = None
+    # Registered graph id; with graph set, the graph is registered under it first
+    template: Optional[str] = None
+    # "node_id.field" -> value, applied to a copy of the template
+    overrides: Optional[Dict[str, Any]] = None
     nodes: Optional[List[NodeInfo]] = None
     models: Optional[List[ModelInfo]] = None
     hugging_face_token: Optional[str] = None
@@ -3,79 +3,148 @@ from pathlib import Path
 import time
 import os
 import json
+import asyncio
+import threading
+from typing import Optional
+from runpod import RunPodLogger
+
+log = RunPodLogger()
 
 
 class StalePortaLock:
-    def __init__(self, path: Path, stale_threshold=600):
-        self.lock_path = (path / ".lock").resolve()
-        self.data_path = (path / ".lock.data").resolve()
+    def __init__(self, path: Path, stale_threshold=600, name: Optional[str] = None, shared: bool = False, heartbeat_interval: Optional[float] = None):
+        # One lock file per resource; no name keeps the original volume-wide ".lock"
+        lock_name = f".lock.{name}" if name else ".lock"
+        self.lock_path = (path / lock_name).resolve()
+        self.data_path = (path / f"{lock_name}.data").resolve()
         self.stale_threshold = stale_threshold
+        self.shared = shared
+        self.heartbeat_interval = heartbeat_interval if heartbeat_interval else max(1, stale_threshold / 4)
         self.lock = None
         self.timeout = None
-        
+        self._heartbeat = None
+        self._heartbeat_stop = threading.Event()
+        self._stale_seen = False
+
     def _write_lock_data(self):
         data = {
             'timestamp': time.time(),
-            'pid': os.getpid()
+            'pid': os.getpid(),
+            'shared': self.shared
         }
-        with open(self.data_path, 'w') as f:
+        temp_path = self.data_path.with_name(f"{self.data_path.name}.{os.getpid()}.{threading.get_ident()}")
+        with open(temp_path, 'w') as f:
             json.dump(data, f)
-            
+        os.replace(temp_path, self.data_path)
+
     def _read_lock_data(self):
         try:
             with open(self.data_path, 'r') as f:
                 return json.load(f)
         except (FileNotFoundError, json.JSONDecodeError):
             return None
-            
+
     def _is_stale(self):
+        # A new holder touches the lock file before writing its data, so a fresh mtime keeps it alive
         data = self._read_lock_data()
-        if not data:
-            return True
-        lock_time = data.get('timestamp', 0)
+        lock_time = data.get('timestamp', 0) if data else 0
+        try:
+            lock_time = max(lock_time, os.stat(self.lock_path).st_mtime)
+        except FileNotFoundError:
+            pass
         return (time.time() - lock_time) > self.stale_threshold
-        
+
+    def _try_acquire(self) -> bool:
+        try:
+            self.lock = open(self.lock_path, 'ab')
+            mode = portalocker.LOCK_SH if self.shared else portalocker.LOCK_EX
+            portalocker.lock(self.lock, mode | portalocker.LOCK_NB)
+        except (portalocker.LockException, OSError):
+            if self.lock:
+                self.lock.close()
+                self.lock = None
+
+            # Only break a lock whose holder stopped sending heartbeats, seen stale on two attempts in a row
+            stale = self._is_stale()
+            if stale and self._stale_seen:
+                self._stale_seen = False
+                log.warn(f"Break stale lock {self.lock_path}")
+                for path in (self.lock_path, self.data_path):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            else:
+                self._stale_seen = stale
+            return False
+
+        self._stale_seen = False
+        os.utime(self.lock.fileno())
+        self._write_lock_data()
+        self._start_heartbeat()
+        return True
+
     def acquire(self, timeout=None):
         timeout = timeout if timeout else self.timeout
         start_time = time.time()
-        
-        while True:
-            if self._is_stale():
-                try:
-                    os.remove(self.lock_path)
-                    os.remove(self.data_path)
-                except FileNotFoundError:
-                    pass
-            
-            try:
-                self.lock = open(self.lock_path, 'wb')
-                portalocker.lock(self.lock, portalocker.LOCK_EX | portalocker.LOCK_NB)
-                self._write_lock_data()
-                return True
-            except (portalocker.LockException, OSError):
-                if self.lock:
-                    self.lock.close()
-                    self.lock = None
-                
-                if timeout is not None:
-                    if time.time() - start_time >= timeout:
-                        raise TimeoutError(f"Could not acquire lock on {self.lock_path} within {timeout} seconds")
-                
-                time.sleep(0.1)
-        
+
+        while not self._try_acquire():
+            if timeout is not None:
+                if time.time() - start_time >= timeout:
+                    raise TimeoutError(f"Could not acquire lock on {self.lock_path} within {timeout} seconds")
+            time.sleep(0.1)
+        return True
+
+    async def acquire_async(self, timeout=None):
+        timeout = timeout if timeout else self.timeout
+        start_time = time.time()
+
+        while not self._try_acquire():
+            if timeout is not None:
+                if time.time() - start_time >= timeout:
+                    raise TimeoutError(f"Could not acquire lock on {self.lock_path} within {timeout} seconds")
+            await asyncio.sleep(0.1)
+        return True
+
     def release(self):
         if self.lock:
-            try:
-                os.remove(self.data_path)
-            except FileNotFoundError:
-                pass
+            # The data file stays: removing it would leave the next holder without data
+            self._stop_heartbeat()
             portalocker.unlock(self.lock)
             self.lock.close()
             self.lock = None
-            
+
+    def _start_heartbeat(self):
+        self._heartbeat_stop.clear()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+
+    def _stop_heartbeat(self):
+        if self._heartbeat:
+            self._heartbeat_stop.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def _heartbeat_loop(self):
+        # Keeps long installs from being declared stale; a thread, so a busy event loop can't starve it
+        while not self._heartbeat_stop.wait(self.heartbeat_interval):
+            try:
+                if os.stat(self.lock_path).st_ino != os.fstat(self.lock.fileno()).st_ino:
+                    log.warn(f"Lock {self.lock_path} was broken by another worker")
+                self._write_lock_data()
+            except (OSError, ValueError, AttributeError) as e:
+                log.warn(f"Lock heartbeat failed for {self.lock_path}: {e}")
+
     def __enter__(self):
         self.acquire()
         return self
-        
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
         self.release()
\ No newline at end of file
@@ -0,0 +1,122 @@
+import asyncio
+import subprocess
+from pathlib import Path
+from typing import Optional
+from runpod import RunPodLogger
+from invoke import Invoke
+from .image_processor import ImageProcessor
+from .invoke_manager import InvokeManager
+from .job_gate import JobGate
+from .input_image_cache import InputImageCache
+from .result_cache import ResultCache
+from .cleanup_policy import CleanupPolicy
+from .graph_templates import GraphTemplates
+
+log = RunPodLogger()
+
+
+class WorkerRuntime:
+    def __init__(
+        self, 
+        invoke_path: Path, 
+        storage_path: Optional[Path] = None, 
+        image_processor: Optional[ImageProcessor] = None, 
+        max_concurrency: int = 1,
+        input_concurrency: int = 4,
+        direct_outputs: bool = False,
+        input_cache: Optional[InputImageCache] = None,
+        result_cache_max_items: int = 0,
+        result_cache_ttl: float = 60 * 60 * 24,
+        result_cache_shared: bool = False,
+        cleanup_policy: Optional[CleanupPolicy] = None,
+        model_install_concurrency: int = 4,
+        model_hash_workers: int = 4,
+        node_restart_policy: str = "coalesce",
+        node_restart_delay: float = 0,
+        model_cache_path: Optional[Path] = None,
+        model_cache_size: int = 0,
+        download_cache_size: int = 0,
+        download_cache_interval: float = 60
+    ):
+        self.invoke_path = invoke_path
+        self.max_concurrency = max(1, max_concurrency)
+        self.input_concurrency = max(1, input_concurrency)
+        self.manager = InvokeManager(
+            invoke_path=invoke_path, 
+            storage_path=storage_path, 
+            model_install_concurrency=model_install_concurrency,
+            model_hash_workers=model_hash_workers,
+            model_cache_path=model_cache_path,
+            model_cache_size=model_cache_size,
+            download_cache_size=download_cache_size,
+            download_cache_interval=download_cache_interval
+        )
+        self.image_processor = image_processor if image_processor else ImageProcessor()
+        self.input_cache = input_cache if input_cache else InputImageCache(max_items=0)
+        self.result_cache = ResultCache(
+            max_items=result_cache_max_items,
+            ttl=result_cache_ttl,
+            shared_path=self.manager.storage_path / "result_cache.json" if result_cache_shared and self.manager.is_storage_use() else None,
+            shared_lock=self.manager.get_lock("result_cache", "result_cache.json", timeout=10)
+        )
+        self.cleanup_policy = cleanup_policy if cleanup_policy else CleanupPolicy()
+        self.templates = GraphTemplates(self.manager.templates_path, self.manager.registry)
+        self.clear_task: Optional[asyncio.Task] = None
+        self.download_cache_task: Optional[asyncio.Task] = None
+        self.outputs_path = self.manager.get_outputs_images_path() if direct_outputs else None
+        self.job_gate = JobGate()
+        # Highest queue item id seen, so batch scans start after the jobs already done
+        self.queue_cursor: Optional[int] = None
+        self.install_lock = asyncio.Lock()
+        self.node_restart_policy = node_restart_policy
+        self.node_restart_delay = node_restart_delay
+        self._restart_task: Optional[asyncio.Future] = None
+        self.invoke: Optional[Invoke] = None
+        self._start_lock = asyncio.Lock()
+
+
+    def is_shared_mode(self) -> bool:
+        return self.max_concurrency > 1
+
+
+    async def start(self) -> Invoke:
+        # The HTTP session must live on the loop that runs the jobs, so it is opened on first use
+        if self.invoke:
+            return self.invoke
+        async with self._start_lock:
+            if not self.invoke:
+                log.info("Start worker runtime")
+                self.invoke = Invoke()
+        return self.invoke
+
+
+    async def request_restart(self):
+        # New nodes load only on restart: "defer" leaves them for the next boot,
+        # "coalesce" lets every job that asks within the delay share one restart
+        if self.node_restart_policy == "defer":
+            log.warn("New nodes installed, they will be loaded on the next worker start")
+            return
+        if not self._restart_task:
+            self._restart_task = asyncio.ensure_future(self._restart())
+        await asyncio.shield(self._restart_task)
+
+
+    async def _restart(self):
+        try:
+            await asyncio.sleep(self.node_restart_delay)
+        finally:
+            # Nodes installed from here on need a restart of their own
+            self._restart_task = None
+
+        # Restart only when no other job is using InvokeAI
+        async with self.job_gate.exclusive():
+            log.info("Wait InvokeAI restart...")
+            await asyncio.to_thread(subprocess.run, ["supervisorctl", "restart", "invokeai"], check=True)
+            version = await self.invoke.wait_invoke()
+            log.info(f"version = {version}")
+
+
+    async def close(self):
+        if self.invoke:
+            await self.invoke.close()
+            self.invoke = None
\ No newline at end of file
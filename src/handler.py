@@ -3,175 +3,590 @@ import asyncio
 import runpod
 import traceback
 import argparse
-import subprocess
 from pathlib import Path
 from runpod import RunPodLogger
-from typing import List
+from typing import List, Optional, Dict, Set, Tuple, AsyncIterator
 from invoke import Invoke
 from invoke.graph_builder.components import Batch, BatchRoot, Graph
 from invoke.api.images import Categories
+from invoke.api.queue import SessionQueueItem
+from invoke.api.models import ModelRecord
 from app.schema import *
 from app.image_processor import ImageProcessor
-from app.invoke_manager import InvokeManager
-from concurrent.futures import ThreadPoolExecutor
+from app.bucket_transfer import MB
+from app.worker_runtime import WorkerRuntime
+from app.input_image_cache import InputImageCache
+from app.result_cache import ResultCache
+from app.cleanup_policy import CleanupPolicy
+from app.phase_timer import PhaseTimer
 
 log = RunPodLogger()
 
+runtime: Optional[WorkerRuntime] = None
 
-async def handler(task: JobTask, invoke_path: Path) -> ResponseTask:
-    async with Invoke() as invoke:
-        # Image file manager
-        log.debug("Create Invoke manager")
-        storage_path=os.environ.get('STORAGE_PATH', None)
-        manager = InvokeManager(
-            invoke_path=invoke_path,
-            storage_path=Path(storage_path) if storage_path else None
-        )
-
-        # Install requirements
-        if task.models or task.nodes:
-            await manager.install_models(task.models)
-            need_reload = await manager.install_nodes(task.nodes)
-            manager.save_db()
+
+async def clear_all(invoke: Invoke, keep: Optional[Set[str]] = None):
+    # Intermediates and the invocation cache are left to the cleanup policy
+    old_images = await invoke.images.list_image_dtos(offset=0, limit=1000, is_intermediate=False)
+    old_images_names = [item.image_name for item in old_images.items if not keep or item.image_name not in keep]
+    for record in old_images_names:
+        log.debug(f"Delete: {record}")
+    await invoke.images.delete_by_list(old_images_names)
+    await invoke.queue.clear()
+
+
+def clear_caches(invoke: Invoke, runtime: WorkerRuntime):
+    policy = runtime.cleanup_policy
+    policy.job_done()
+    if not policy.should_clear(runtime.job_gate.active) or (runtime.clear_task and not runtime.clear_task.done()):
+        return
+
+    async def clear():
+        # Runs between jobs, so the finished job does not wait for it
+        try:
+            async with runtime.job_gate.exclusive():
+                await invoke.images.clear_intermediates()
+                await invoke.app.clear_invocation_cache()
+            policy.cleared()
+            log.debug("Intermediates and invocation cache cleared")
+        except Exception as e:
+            log.error(f"Failed to clear caches: {e}")
+
+    runtime.clear_task = asyncio.create_task(clear())
+
+
+def refresh_download_cache(runtime: WorkerRuntime):
+    download_cache = runtime.manager.download_cache
+    if not download_cache.is_due() or (runtime.download_cache_task and not runtime.download_cache_task.done()):
+        return
+
+    async def refresh():
+        # Files InvokeAI downloaded during jobs are indexed and trimmed in the background
+        try:
+            await asyncio.to_thread(download_cache.refresh)
+        except Exception as e:
+            log.error(f"Failed to refresh download cache: {e}")
+
+    runtime.download_cache_task = asyncio.create_task(refresh())
+
+
+async def get_batch_queue_items(
+    invoke: Invoke, 
+    batch_id: str, 
+    status: Optional[str] = None, 
+    cursor: Optional[int] = None
+) -> List[int]:
+    # Items come in item_id order; a cursor taken before the enqueue skips all older jobs
+    item_ids: List[int] = []
+    cursor = str(cursor) if cursor else None
+    while True:
+        page = await invoke.queue.list(limit=100, status=status, cursor=cursor)
+        item_ids += [item.item_id for item in page.items if item.batch_id == batch_id]
+        if not page.has_more or not page.items:
+            return item_ids
+        cursor = str(page.items[-1].item_id)
+
+
+def get_session_images(queue_item: SessionQueueItem) -> Dict[str, bool]:
+    # image_name -> is_intermediate, taken from the session's own results
+    session = queue_item.session
+    images: Dict[str, bool] = {}
+    nodes = session.graph.nodes or {}
+    mapping = session.prepared_source_mapping or {}
+    for prepared_id, output in (session.results or {}).items():
+        image = output.get("image") if isinstance(output, dict) else None
+        if not image or not image.get("image_name"):
+            continue
+        node = nodes.get(mapping.get(prepared_id, prepared_id), {})
+        images[image["image_name"]] = bool(node.get("is_intermediate", False))
+    return images
+
+
+async def get_batch_images(
+    invoke: Invoke, 
+    batch_id: str, 
+    status: Optional[str] = None, 
+    cursor: Optional[int] = None
+) -> Dict[str, bool]:
+    item_ids = await get_batch_queue_items(invoke, batch_id, status, cursor)
+    if cursor and not item_ids:
+        item_ids = await get_batch_queue_items(invoke, batch_id, status)
+    queue_items = await asyncio.gather(*[invoke.queue.get_queue_item(item_id) for item_id in item_ids])
+    images: Dict[str, bool] = {}
+    for queue_item in queue_items:
+        images.update(get_session_images(queue_item))
+    return images
+
+
+async def iter_batch_items(
+    invoke: Invoke, 
+    batch_id: str, 
+    delay: float = 0.1, 
+    cursor: Optional[int] = None
+) -> AsyncIterator[SessionQueueItem]:
+    # Yield each queue item of the batch as soon as its session completes
+    done: set = set()
+    while True:
+        await asyncio.sleep(delay)
+        status = await invoke.queue.get_batch_status(batch_id)
+
+        if status.failed:
+            raise Exception("Batch error")
+
+        if status.canceled:
+            raise Exception("Batch canceled")
+
+        if status.completed > len(done):
+            item_ids = await get_batch_queue_items(invoke, batch_id, "completed", cursor)
+            if cursor and len(item_ids) < status.completed:
+                # Item ids restarted after the queue was emptied: scan from the start from now on
+                cursor = None
+                item_ids = await get_batch_queue_items(invoke, batch_id, "completed")
+            for item_id in item_ids:
+                if item_id not in done:
+                    done.add(item_id)
+                    yield await invoke.queue.get_queue_item(item_id)
+
+        if len(done) >= status.total:
+            return
+
+
+async def ingest_images(
+    invoke: Invoke, 
+    image_processor: ImageProcessor, 
+    image_cache: InputImageCache, 
+    images: List[ImageInfo], 
+    limit: int, 
+    ready: asyncio.Event, 
+    uploaded: List[str], 
+    cache_keys: List[str]
+) -> Dict[str, str]:
+    # node id -> image_name; at most `limit` images are held in memory at once
+    semaphore = asyncio.Semaphore(limit)
+
+    async def ingest(image: ImageInfo) -> Tuple[str, str]:
+        async with semaphore:
+            # Already in InvokeAI from an earlier job: skip fetch and upload
+            key = InputImageCache.source_key(image) if image_cache.is_enabled() else None
+            image_name = image_cache.acquire(key) if key else None
+            if image_name:
+                cache_keys.append(key)
+                return image.id, image_name
+
+            item = await image_processor.run(image_processor.download_image, image)
+            log.debug(f"Image download: {item.id}")
+
+            if image_cache.is_enabled() and not key:
+                key = InputImageCache.content_key(item.data)
+                image_name = image_cache.acquire(key)
+                if image_name:
+                    cache_keys.append(key)
+                    return item.id, image_name
+
+            await ready.wait()
+            result = await invoke.images.upload(item.data, Categories.User)
+            if not key:
+                uploaded.append(result.image_name)
+                return item.id, result.image_name
+
+            image_name = image_cache.add(key, result.image_name, len(item.data))
+            cache_keys.append(key)
+            if image_name != result.image_name:
+                uploaded.append(result.image_name)
+            return item.id, image_name
+
+    results = await asyncio.gather(*[ingest(image) for image in images], return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return dict(results)
+
+
+async def upload_outputs(
+    invoke: Invoke, 
+    image_processor: ImageProcessor, 
+    image_names: List[str], 
+    outputs_path: Optional[Path] = None
+) -> List[ImageInfo]:
+    generate_images: List[ImageData] = []
+    http_names: List[str] = []
+
+    # Same machine as InvokeAI: read outputs straight from its outputs folder
+    for name in image_names:
+        file_path = outputs_path / name if outputs_path else None
+        if file_path and file_path.is_file():
+            generate_images.append(ImageData(file_path=file_path.as_posix(), id=name))
+        else:
+            http_names.append(name)
+
+    images_data = await asyncio.gather(*[invoke.images.get_full(name) for name in http_names])
+    generate_images += [
+        ImageData(data=data, id=name) for name, data in zip(http_names, images_data)
+    ]
+    return list(await asyncio.gather(*[
+        image_processor.run(image_processor.upload_image, image) for image in generate_images
+    ]))
+
+
+async def handler(task: JobTask, runtime: WorkerRuntime, timer: PhaseTimer) -> AsyncIterator[ImageInfo]:
+    with timer.phase("runtime"):
+        invoke = await runtime.start()
+    manager = runtime.manager
+
+    # Install requirements
+    if task.models or task.nodes:
+        with timer.phase("install"):
+            async with runtime.install_lock:
+                models_changed = await manager.install_models(invoke, task.models)
+                need_reload = await manager.install_nodes(task.nodes)
+                # InvokeAI writes queue and image rows on every job, so only installs decide a DB push
+                if models_changed or need_reload:
+                    await asyncio.to_thread(manager.save_db)
+                await asyncio.to_thread(manager.update_manifest, task.nodes, task.models)
             if need_reload:
-                log.info("Wait InvokeAI restart...")
-                subprocess.run(["supervisorctl", "restart", "invokeai"], check=True)
-                version = await invoke.wait_invoke()
-                log.info(f"version = {version}")
-
-        # Image file manager
-        log.debug("Create Image file manager")
-        image_processor = ImageProcessor(
-            bucket_name=os.environ.get('BUCKET_NAME', None),
-            endpoint_url=os.environ.get('BUCKET_ENDPOINT_URL', None),
-            aws_access_key_id=os.environ.get('BUCKET_ACCESS_KEY_ID', None),
-            aws_secret_access_key=os.environ.get('BUCKET_SECRET_ACCESS_KEY', None)
-        )
-
-        # Create batch
-        log.debug("Create batch")
-        batch = Batch(
-            graph=Graph.model_validate_json(task.graph)
-        )
-
-        # Update and validate models hash
-        log.debug("Update and validate models hash")
-        all_models = await invoke.models.list()
-        if not all_models:
-            raise Exception("Failed to get models list")
-        for record in all_models:
-            log.debug(f"{record.base}:{record.type}:{record.name}")
-        batch.update_models_hash(all_models)
-            
-        # Clear
-        log.debug("Clear")
-        old_images = await invoke.images.list_image_dtos(offset=0, limit=1000)
-        old_images_names = [item.image_name for item in old_images.items]
-        for record in old_images_names:
-            log.debug(f"Delete: {record}")
-        await invoke.images.delete_by_list(old_images_names)
-        await invoke.queue.clear()
-        await invoke.images.clear_intermediates()
-        await invoke.app.clear_invocation_cache()
-        
-        # Upload images
-        log.debug("Upload images")
-        # TODO add ThreadPoolExecutor 
+                await runtime.request_restart()
+
+    # Create batch
+    log.debug("Create batch")
+    model_records = None
+    with timer.phase("parse_graph"):
+        if task.template:
+            if task.graph:
+                await asyncio.to_thread(runtime.templates.register, task.template, task.graph)
+            graph, model_records = await runtime.templates.get(invoke, task.template, task.overrides)
+            log.debug(f"Graph templates: {runtime.templates.stats()}")
+        elif task.graph:
+            graph = Graph.model_validate_json(task.graph)
+        else:
+            raise ValueError("Job needs a graph or a template")
+        batch = Batch(graph=graph)
+
+    try:
+        async for image in run_batch(task, batch, invoke, runtime, timer, model_records):
+            yield image
+    finally:
+        clear_caches(invoke, runtime)
+        refresh_download_cache(runtime)
+
+
+async def run_batch(
+    task: JobTask, 
+    batch: Batch, 
+    invoke: Invoke, 
+    runtime: WorkerRuntime, 
+    timer: PhaseTimer, 
+    model_records: Optional[List[ModelRecord]] = None
+) -> AsyncIterator[ImageInfo]:
+    image_processor = runtime.image_processor
+
+    async with runtime.job_gate.shared():
         upload_images: List[str] = []
-        if task.images:        
-            download_images = image_processor.download_images(task.images)
-            for item in download_images:
-                log.debug(f"Image download: {item.id}")
-                image = await invoke.images.upload(item.data, Categories.User)
-                batch.graph.nodes[item.id]["image"] = {
-                    "image_name": image.image_name
-                }
-                upload_images.append(image.image_name)
-
-        # Run batch
-        log.debug("Run batch")
-        batch_root = BatchRoot(batch=batch).model_dump_json()
-        enqueue_batch = await invoke.queue.enqueue_batch(batch_root)
-        log.debug("Wait batch...")
-        await invoke.wait_batch(enqueue_batch)
-
-        # Delete upload images
-        log.debug("Delete upload images")
-        if upload_images:
-            log.debug("upload_images")
-            await invoke.images.delete_by_list(upload_images)
-
-        # Get last generate images
-        log.debug("Get last generate images")
-        last_images = await invoke.images.list_image_dtos(offset=0, limit=1000)
-
-        # Upload last generate images
-        log.debug("Upload last generate images")
-        generate_images: List[ImageData] = []
-        for item in last_images.items:
-            if not item.is_intermediate:
-                item_data = await invoke.images.get_full(item.image_name)
-                generate_images.append(ImageData(
-                    data=item_data, 
-                    id=item.image_name
+        cache_keys: List[str] = []
+        result_images: List[ImageInfo] = []
+        batch_id: Optional[str] = None
+        batch_images: Dict[str, bool] = {}
+        batch_done = False
+        queue_cursor: Optional[int] = None
+        inputs_ready = asyncio.Event()
+        ingest_task: Optional[asyncio.Task] = None
+        model_keys: List[str] = []
+        try:
+            # Update and validate models hash (templates come resolved)
+            if model_records is None:
+                log.debug("Update and validate models hash")
+                with timer.phase("resolve_models"):
+                    model_records = await runtime.manager.registry.resolve_graph(invoke, batch.graph)
+
+            # Repeated deterministic graph: return the stored outputs before fetching any input
+            result_key = None
+            if runtime.result_cache.is_enabled():
+                result_key = ResultCache.make_key(batch.graph, task.images)
+                cached_images = await runtime.result_cache.get(result_key) if result_key else None
+                log.debug(f"Result cache: {runtime.result_cache.stats()}")
+                if cached_images:
+                    timer.mark("result_cache_hit")
+                    batch_done = True
+                    for cached_image in cached_images:
+                        yield cached_image
+                    return
+
+            # Fetch input images while InvokeAI is cleared
+            if task.images:
+                ingest_task = asyncio.create_task(ingest_images(
+                    invoke, 
+                    image_processor, 
+                    runtime.input_cache, 
+                    task.images, 
+                    runtime.input_concurrency, 
+                    inputs_ready, 
+                    upload_images, 
+                    cache_keys
                 ))
-        out_images = image_processor.upload_images(generate_images)
 
-        # Delete last generate images
-        log.debug("Delete last generate images")
-        await invoke.images.delete_by_list([item.image_name for item in last_images.items])
-        
-        return ResponseTask(
-            images=out_images
-        )
+            # Copy volume models to local disk for the next jobs; pinned so they are not evicted mid-run
+            model_keys = runtime.manager.model_cache.use(invoke, model_records)
 
+            # Clear (only when the job owns the whole InvokeAI instance)
+            if not runtime.is_shared_mode():
+                log.debug("Clear")
+                with timer.phase("clear"):
+                    await clear_all(invoke, keep=runtime.input_cache.names())
+                    runtime.queue_cursor = None
+            inputs_ready.set()
 
-def create_handler(job):
-    invoke_path = None
-    try:
-        parser = argparse.ArgumentParser()
-        parser.add_argument("--invoke", type=str, required=True)
-        args = parser.parse_args()
-        invoke_path=Path(args.invoke)
+            # Upload images
+            if ingest_task:
+                log.debug("Wait input images")
+                with timer.phase("wait_inputs"):
+                    for node_id, image_name in (await ingest_task).items():
+                        batch.graph.nodes[node_id]["image"] = {
+                            "image_name": image_name
+                        }
 
-        log.info("Start job")
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        with ThreadPoolExecutor() as executor:
-            future = executor.submit(loop.run_until_complete, handler(
-                invoke_path=invoke_path,
-                task=JobTask.model_validate(job['input'])
-            ))
-            response: ResponseTask = future.result()
-            log.info("Done")
-            return response.model_dump()
-    except Exception as e:
-        invokeai_log = None
-        if invoke_path:
-            invokeai_log_path = invoke_path / "invokeai.log"
-            if invokeai_log_path.exists():
-                invokeai_log = invokeai_log_path.read_text()
+            # Invocation cache counters before the run
+            cache_status = await invoke.app.get_invocation_cache_status()
 
+            # Run batch
+            log.debug("Run batch")
+            with timer.phase("enqueue"):
+                batch_root = BatchRoot(batch=batch).model_dump_json()
+                queue_cursor = runtime.queue_cursor
+                enqueue_batch = await invoke.queue.enqueue_batch(batch_root)
+                batch_id = enqueue_batch.batch.batch_id
+
+            # Upload generated images of every finished session
+            log.debug(f"Wait batch {batch_id}...")
+            async for queue_item in iter_batch_items(invoke, batch_id, cursor=queue_cursor):
+                runtime.queue_cursor = max(runtime.queue_cursor or 0, queue_item.item_id)
+                session_images = get_session_images(queue_item)
+                batch_images.update(session_images)
+                with timer.phase("upload_outputs"):
+                    out_images = await upload_outputs(
+                        invoke, 
+                        image_processor, 
+                        [name for name, is_intermediate in session_images.items() if not is_intermediate],
+                        runtime.outputs_path
+                    )
+                for out_image in out_images:
+                    timer.mark("first_image")
+                    yield out_image
+                result_images += out_images
+            timer.mark("batch_done")
+            batch_done = True
+
+            # Nodes served from the invocation cache (includes concurrent jobs in shared mode)
+            done_cache_status = await invoke.app.get_invocation_cache_status()
+            timer.count("invocation_cache_hits", done_cache_status.hits - cache_status.hits)
+            timer.count("invocation_cache_misses", done_cache_status.misses - cache_status.misses)
+
+            if result_key:
+                await runtime.result_cache.put(result_key, result_images)
+        finally:
+            # Delete job images
+            log.debug("Delete job images")
+            try:
+                with timer.phase("cleanup"):
+                    if ingest_task and not ingest_task.done():
+                        ingest_task.cancel()
+                        await asyncio.gather(ingest_task, return_exceptions=True)
+                    if batch_id and not batch_done:
+                        await invoke.queue.cancel_by_batch_ids([batch_id])
+                        batch_images.update(await get_batch_images(invoke, batch_id, cursor=queue_cursor))
+                    job_images = upload_images + [name for name, is_intermediate in batch_images.items() if not is_intermediate]
+                    runtime.input_cache.release(cache_keys)
+                    runtime.manager.model_cache.release(model_keys)
+                    if not batch_done:
+                        job_images += runtime.input_cache.discard(cache_keys)
+                    job_images += runtime.input_cache.evict()
+                    log.debug(f"Input cache: {runtime.input_cache.stats()}")
+                    if job_images:
+                        await invoke.images.delete_by_list(job_images)
+                    if runtime.is_shared_mode() and runtime.job_gate.active == 1:
+                        await invoke.queue.prune()
+                        runtime.queue_cursor = None
+            except Exception as e:
+                log.error(f"Failed to clean up job: {e}")
+
+
+def error_response(e: Exception, timer: PhaseTimer) -> dict:
+    invokeai_log = None
+    invokeai_log_path = runtime.invoke_path / "invokeai.log"
+    if invokeai_log_path.exists():
+        invokeai_log = invokeai_log_path.read_text()
+
+    return ResponseTask(
+        error=str(e), 
+        meta_data={
+            "error": str(e), 
+            "traceback": traceback.format_exc(),
+            "invokeai_log": invokeai_log,
+            "timings": timer.timings,
+            "counters": timer.counters
+        }
+    ).model_dump()
+
+
+async def create_handler(job):
+    timer = PhaseTimer()
+    try:
+        log.info("Start job")
+        task = JobTask.model_validate(job['input'])
+        images = [image async for image in handler(task=task, runtime=runtime, timer=timer)]
+        log.info("Done")
         return ResponseTask(
-            error=str(e), 
-            meta_data={
-                "error": str(e), 
-                "traceback": traceback.format_exc(),
-                "invokeai_log": invokeai_log
-            }
+            images=images,
+            meta_data={"timings": timer.timings, "counters": timer.counters}
         ).model_dump()
+    except Exception as e:
+        return error_response(e, timer)
+
+
+async def create_stream_handler(job):
+    timer = PhaseTimer()
+    try:
+        log.info("Start stream job")
+        task = JobTask.model_validate(job['input'])
+        async for image in handler(task=task, runtime=runtime, timer=timer):
+            yield ResponseTask(images=[image]).model_dump()
+        log.info("Done")
+        yield ResponseTask(meta_data={"timings": timer.timings, "counters": timer.counters}).model_dump()
+    except Exception as e:
+        yield error_response(e, timer)
         
 
-async def setup():
+async def warm_up(invoke: Invoke, graph: str):
+    # Run a graph once so its models are loaded before the first request
+    batch = Batch(graph=Graph.model_validate_json(graph))
+    await runtime.manager.registry.resolve_graph(invoke, batch.graph)
+    enqueue_batch = await invoke.queue.enqueue_batch(BatchRoot(batch=batch).model_dump_json())
+    batch_id = enqueue_batch.batch.batch_id
+    try:
+        async for _ in iter_batch_items(invoke, batch_id):
+            pass
+    finally:
+        batch_images = await get_batch_images(invoke, batch_id)
+        output_images = [name for name, is_intermediate in batch_images.items() if not is_intermediate]
+        if output_images:
+            await invoke.images.delete_by_list(output_images)
+
+
+async def setup(warmup_graph: Optional[str] = None, prefetch_models: Optional[List[str]] = None):
+    # Continues the boot timeline started by prep.py
+    timer = PhaseTimer.load(runtime.invoke_path / "boot_timeline.json")
     async with Invoke() as invoke:
         log.info("Wait InvokeAI...")
-        version = await invoke.wait_invoke()
+        with timer.phase("invokeai_wait"):
+            version = await invoke.wait_invoke()
+        timer.add("invokeai_ready", timer.elapsed())
         log.info(f"version = {version}")
 
+        # Register manifest models before the first job (cheap when the synced DB has them)
+        manifest = runtime.manager.load_manifest()
+        if manifest.models:
+            with timer.phase("manifest_models"):
+                try:
+                    if await runtime.manager.install_models(invoke, manifest.models):
+                        await asyncio.to_thread(runtime.manager.save_db)
+                except Exception as e:
+                    log.error(f"Failed to apply manifest models: {e}")
+
+        # The synced DB points at the volume: switch cached models back to local copies, then prefetch
+        if runtime.manager.model_cache.is_enabled():
+            with timer.phase("model_cache"):
+                try:
+                    await runtime.manager.model_cache.restore(invoke)
+                    await runtime.manager.model_cache.prefetch(invoke, prefetch_models)
+                    log.info(f"Model cache: {runtime.manager.model_cache.stats()}")
+                except Exception as e:
+                    log.error(f"Failed to prepare model cache: {e}")
+
+        if runtime.manager.download_cache.is_enabled():
+            with timer.phase("download_cache"):
+                try:
+                    await asyncio.to_thread(runtime.manager.download_cache.refresh)
+                except Exception as e:
+                    log.error(f"Failed to refresh download cache: {e}")
+
+        if warmup_graph:
+            log.info("Run warm-up graph...")
+            with timer.phase("warmup"):
+                try:
+                    await warm_up(invoke, warmup_graph)
+                except Exception as e:
+                    log.error(f"Warm-up failed: {e}")
+
+    timer.add("boot_total", timer.elapsed())
+    log.info(f"Boot timeline: {timer.timings}")
+
 
 def main():
-    asyncio.run(setup())
-    runpod.serverless.start({"handler": create_handler})
+    global runtime
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invoke", type=str, required=True)
+    args = parser.parse_args()
+
+    # Worker runtime, shared by every job of this worker
+    storage_path=os.environ.get('STORAGE_PATH', None)
+    model_cache_path=os.environ.get('MODEL_CACHE_PATH', None)
+    runtime = WorkerRuntime(
+        invoke_path=Path(args.invoke),
+        storage_path=Path(storage_path) if storage_path else None,
+        image_processor=ImageProcessor(
+            bucket_name=os.environ.get('BUCKET_NAME', None),
+            endpoint_url=os.environ.get('BUCKET_ENDPOINT_URL', None),
+            aws_access_key_id=os.environ.get('BUCKET_ACCESS_KEY_ID', None),
+            aws_secret_access_key=os.environ.get('BUCKET_SECRET_ACCESS_KEY', None),
+            max_pool_connections=int(os.environ.get('BUCKET_MAX_POOL_CONNECTIONS', 16)),
+            max_attempts=int(os.environ.get('BUCKET_MAX_ATTEMPTS', 5)),
+            multipart_threshold=int(os.environ.get('BUCKET_MULTIPART_THRESHOLD_MB', 8)) * MB,
+            multipart_chunksize=int(os.environ.get('BUCKET_MULTIPART_CHUNKSIZE_MB', 8)) * MB,
+            multipart_concurrency=int(os.environ.get('BUCKET_MULTIPART_CONCURRENCY', 4))
+        ),
+        max_concurrency=int(os.environ.get('MAX_CONCURRENCY', 1)),
+        input_concurrency=int(os.environ.get('INPUT_CONCURRENCY', 4)),
+        direct_outputs=os.environ.get('DIRECT_OUTPUTS', 'false').lower() == 'true',
+        input_cache=InputImageCache(
+            max_items=int(os.environ.get('INPUT_CACHE_MAX_ITEMS', 256)),
+            max_bytes=int(os.environ.get('INPUT_CACHE_SIZE_MB', 1024)) * MB
+        ),
+        result_cache_max_items=int(os.environ.get('RESULT_CACHE_MAX_ITEMS', 0)),
+        result_cache_ttl=float(os.environ.get('RESULT_CACHE_TTL', 60 * 60 * 24)),
+        result_cache_shared=os.environ.get('RESULT_CACHE_SHARED', 'false').lower() == 'true',
+        cleanup_policy=CleanupPolicy(
+            mode=os.environ.get('CLEANUP_POLICY', CleanupPolicy.ALWAYS),
+            every_n=int(os.environ.get('CLEANUP_EVERY_N', 10)),
+            path=Path(args.invoke),
+            min_free_disk=int(os.environ.get('CLEANUP_MIN_FREE_DISK_MB', 0)) * MB,
+            min_free_memory=int(os.environ.get('CLEANUP_MIN_FREE_MEMORY_MB', 0)) * MB
+        ),
+        model_install_concurrency=int(os.environ.get('MODEL_INSTALL_CONCURRENCY', 4)),
+        model_hash_workers=int(os.environ.get('MODEL_HASH_WORKERS', 4)),
+        node_restart_policy=os.environ.get('NODE_RESTART_POLICY', 'coalesce'),
+        node_restart_delay=float(os.environ.get('NODE_RESTART_DELAY', 0)),
+        model_cache_path=Path(model_cache_path) if model_cache_path else None,
+        model_cache_size=int(float(os.environ.get('MODEL_CACHE_SIZE_GB', 0)) * 1024 * MB),
+        download_cache_size=int(float(os.environ.get('DOWNLOAD_CACHE_SIZE_GB', 0)) * 1024 * MB),
+        download_cache_interval=float(os.environ.get('DOWNLOAD_CACHE_INTERVAL', 60))
+    )
+
+    # Streaming returns every image as soon as its session is done
+    stream_results = os.environ.get('STREAM_RESULTS', 'false').lower() == 'true'
+
+    # Warm-up graph: JSON, or a path to a JSON file
+    warmup_graph = os.environ.get('WARMUP_GRAPH', None)
+    if warmup_graph and not warmup_graph.lstrip().startswith("{"):
+        warmup_graph = Path(warmup_graph).read_text()
+
+    # Models copied to the local cache at boot: names or sources, comma separated
+    prefetch_models = [name.strip() for name in os.environ.get('MODEL_CACHE_PREFETCH', '').split(",") if name.strip()]
+
+    asyncio.run(setup(warmup_graph, prefetch_models))
+    runpod.serverless.start({
+        "handler": create_stream_handler if stream_results else create_handler,
+        "return_aggregate_stream": stream_results,
+        "concurrency_modifier": lambda current: runtime.max_concurrency
+    })
 
 
 if __name__ == "__main__":
@@ -1,11 +1,32 @@
 import os
 import json
+import asyncio
 import argparse
 from pathlib import Path
 from app.invoke_manager import InvokeManager
+from app.phase_timer import PhaseTimer
+
+
+async def prepare(manager: InvokeManager, timer: PhaseTimer):
+    async def load_db():
+        with timer.phase("prep_load_db"):
+            await asyncio.to_thread(manager.load_db)
+
+    async def install_nodes():
+        # Nodes recorded by earlier jobs, installed before InvokeAI starts
+        with timer.phase("prep_nodes"):
+            await manager.apply_manifest_nodes()
+
+    # The DB copy and node checkouts touch different files, so they run side by side
+    await asyncio.gather(load_db(), install_nodes())
+
+    # Node dependencies overlay from the storage volume
+    with timer.phase("prep_node_deps"):
+        await asyncio.to_thread(manager.sync_node_deps)
 
 
 def main():
+    timer = PhaseTimer()
     parser = argparse.ArgumentParser()
     parser.add_argument("--invoke", type=str, required=True)
     args = parser.parse_args()
@@ -29,10 +50,15 @@ def main():
         user_config = json.loads(user_config)
 
     # Init invokeai config
-    manager.init_config(user_config)
+    with timer.phase("prep_config"):
+        manager.init_config(user_config)
     
-    # Sync DB
-    manager.load_db()
+    # Sync DB, nodes and their dependencies
+    asyncio.run(prepare(manager, timer))
+
+    # Boot timeline, continued by handler.py
+    timer.add("prep_total", timer.elapsed())
+    timer.save(invoke_path / "boot_timeline.json")
 
 
 if __name__ == "__main__":